@@ -3,14 +3,14 @@ from .libs.mir_logger import mir_logger
 from .libs.lsp.server import LanguageServer
 from .libs.lsp.providers import HoverProvider, CompletionProvider
 from .libs.lsp.mir import mir
-from .libs.lsp.view_to_lsp import open_view_with_uri, range_to_region, region_to_range, get_view_uri, point_to_position, position_to_point, parse_uri, file_name_to_uri, is_range, is_text_edit, is_text_document_edit, get_relative_path, selector_to_language_id, get_lines
+from .libs.lsp.view_to_lsp import open_view_with_uri, range_to_region, region_to_range, ranges_to_regions, regions_to_ranges, get_view_uri, point_to_position, position_to_point, points_to_positions, positions_to_points, parse_uri, file_name_to_uri, is_range, is_text_edit, is_text_document_edit, get_relative_path, selector_to_language_id, register_language_id, get_lines, LineReader
 from .libs.lsp.minihtml import minihtml, MinihtmlKind
 from .libs.lsp.manage_servers import servers_for_view, servers_for_window, server_for_view
 from .libs.lsp.workspace_edit import apply_workspace_edit, apply_text_document_edits
 from .libs.activity_indicator import LoaderInStatusBar
 from .open_view import save_view, open_view
 from .runtime import deno, deno2_2, yarn, electron_node, electron_node_18, electron_node_20, electron_node_22
-from .package_storage import PackageStorage, command, unzip
+from .package_storage import PackageStorage, command, unzip, extract
 
 __all__ = (
     # the most useful
@@ -32,6 +32,7 @@ __all__ = (
     'PackageStorage',
     'command',
     'unzip',
+    'extract',
 
     # ui
     'parse_uri',
@@ -40,14 +41,20 @@ __all__ = (
     'open_view_with_uri',
     'get_relative_path',
     'selector_to_language_id',
+    'register_language_id',
     'get_lines',
+    'LineReader',
 
 
     # lsp
     'range_to_region',
     'region_to_range',
+    'ranges_to_regions',
+    'regions_to_ranges',
     'point_to_position',
     'position_to_point',
+    'points_to_positions',
+    'positions_to_points',
     'is_range',
     'is_text_edit',
     'is_text_document_edit',
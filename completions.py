@@ -3,7 +3,7 @@ from .libs.lsp.providers import Providers # Bad, should not expose it like this
 from .libs.lsp.constants import COMPLETION_KINDS
 import sublime
 import sublime_plugin
-from Mir import mir, range_to_region, minihtml, MinihtmlKind
+from Mir import mir, range_to_region, ranges_to_regions, minihtml, MinihtmlKind
 import sublime_aio
 from Mir.types.lsp import CompletionItem, CompletionItemDefaults, TextEdit, InsertReplaceEdit, EditRangeWithInsertReplace, Range, InsertTextFormat
 from typing import Any, Generator, List, Tuple, TypeVar
@@ -161,10 +161,12 @@ class MirApplyTextEditsCommand(sublime_plugin.TextCommand):
     def run(self, edit: sublime.Edit, text_edits: list[TextEdit], show_edits_in_popup=False) -> None:
         if not text_edits:
             return
-        content = []
-        for text_edit in text_edits:
-            self.view.replace(edit, range_to_region(self.view, text_edit['range']), text_edit['newText'])
-            content.append(f"+ {text_edit['newText']}")
+        content = [f"+ {text_edit['newText']}" for text_edit in text_edits]
+        # converted before the first replace, the edits are applied from the end so the regions stay valid
+        regions = ranges_to_regions(self.view, [text_edit['range'] for text_edit in text_edits])
+        edits = sorted(zip(regions, text_edits), key=lambda e: e[0].begin())
+        for region, text_edit in reversed(edits):
+            self.view.replace(edit, region, text_edit['newText'])
         content = f"""```diff
 {" ".join(content)}
 ```"""
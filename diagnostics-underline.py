@@ -1,7 +1,7 @@
 from __future__ import annotations
 import sublime
 import sublime_aio
-from Mir import mir, parse_uri, range_to_region
+from Mir import mir, parse_uri, ranges_to_regions
 from Mir.types.lsp import DiagnosticSeverity, DiagnosticTag
 
 
@@ -41,8 +41,8 @@ class MirDiagnosticListener(sublime_aio.ViewEventListener):
             infos = []
             hints = []
             for _, diagnostics in results:
-                for diagnostic in diagnostics:
-                    region = range_to_region(view, diagnostic['range'])
+                regions = ranges_to_regions(view, [diagnostic['range'] for diagnostic in diagnostics])
+                for diagnostic, region in zip(diagnostics, regions):
                     severity = diagnostic.get('severity', DiagnosticSeverity.Information)
                     tags = diagnostic.get('tags', [])
                     if DiagnosticTag.Unnecessary in tags:
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from Mir import parse_uri, range_to_region
+from Mir import parse_uri, ranges_to_regions
 from Mir.types.lsp import Location
 import sublime
 from Mir import mir, position_to_point, open_view
@@ -24,8 +24,8 @@ def find_reference(
     location: Location | None = None
     location_index = 0
     # find next/prev location
-    for index, reference in enumerate(sorted_references):
-        region = range_to_region(view, reference['range'])
+    regions = ranges_to_regions(view, [reference['range'] for reference in sorted_references])
+    for index, (reference, region) in enumerate(zip(sorted_references, regions)):
         _, file_name = parse_uri(reference['uri'])
         if region.contains(start_point):
             if file_name != view_file_name:
@@ -53,11 +53,8 @@ class Cache:
 
     @staticmethod
     def cache_hit(point: int, view):
-        for ref in Cache.results:
-            r = range_to_region(view, ref['range'])
-            if r.contains(point):
-                return True
-        return False
+        regions = ranges_to_regions(view, [ref['range'] for ref in Cache.results])
+        return any(r.contains(point) for r in regions)
 
 
 
@@ -107,8 +107,9 @@ class LoaderInStatusBar:
         if self._target:
             self._target.clear()
 
-    def __enter__(self) -> None:
+    def __enter__(self) -> LoaderInStatusBar:
         self.start()
+        return self
 
     def __exit__(
         self,
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from typing import List, Tuple, Iterator
 from Mir.types.lsp import DocumentUri, Diagnostic
+from .view_to_lsp import intern_uri
 
 
 class DiagnosticCollection:
@@ -37,8 +38,8 @@ class DiagnosticCollection:
         """
         if isinstance(uri_or_entries, str):
             # Single URI-Diagnostic pair
-            self._diagnostics[uri_or_entries] = diagnostics or []
+            self._diagnostics[intern_uri(uri_or_entries)] = diagnostics or []
         elif isinstance(uri_or_entries, list):
             # Multiple URI-Diagnostic pairs
             for uri, diag_list in uri_or_entries:
-                self._diagnostics[uri] = diag_list
+                self._diagnostics[intern_uri(uri)] = diag_list
@@ -0,0 +1,132 @@
+from __future__ import annotations
+from Mir import mir_logger
+from .metrics import Metrics
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Tuple, TypeVar
+from typing_extensions import TypedDict
+import asyncio
+import time
+
+SourceName = str
+""" The language server name or the provider name """
+
+Feature = Literal['definitions', 'references', 'code_actions', 'hover', 'completions', 'document_symbols']
+
+P = TypeVar('P')
+T = TypeVar('T')
+
+
+class DeadlinePolicy(TypedDict):
+    percentile: float
+    """ The percentile of the provider's recent latencies that the deadline is based on. """
+    multiplier: float
+    min_deadline: float
+    max_deadline: float
+    """ Used until a provider has enough latency samples. Deadlines never go above it. """
+    grace_after_first_result: float | None
+    """
+    Once the first useful result arrives, the remaining providers get at most this many seconds.
+    None means that the feature waits for every provider (up to its deadline).
+    """
+
+
+MIN_SAMPLES = 5
+PROBE_EVERY = 4
+""" After this many timeouts in a row, the next request gets the `max_deadline` to see if the provider recovered. """
+
+deadline_policies: Dict[Feature, DeadlinePolicy] = {
+    # hover and completions show the results of every provider together
+    'hover': {'percentile': 95, 'multiplier': 1.5, 'min_deadline': 0.15, 'max_deadline': 1, 'grace_after_first_result': None},
+    'completions': {'percentile': 95, 'multiplier': 1.5, 'min_deadline': 0.2, 'max_deadline': 1, 'grace_after_first_result': None},
+    'definitions': {'percentile': 95, 'multiplier': 2, 'min_deadline': 0.3, 'max_deadline': 1, 'grace_after_first_result': 0.1},
+    'code_actions': {'percentile': 95, 'multiplier': 2, 'min_deadline': 0.3, 'max_deadline': 1, 'grace_after_first_result': None},
+    'document_symbols': {'percentile': 99, 'multiplier': 2, 'min_deadline': 0.5, 'max_deadline': 2, 'grace_after_first_result': None},
+    'references': {'percentile': 99, 'multiplier': 3, 'min_deadline': 1, 'max_deadline': 5, 'grace_after_first_result': None},
+}
+
+# (feature, provider name) -> number of timeouts in a row
+_consecutive_timeouts: Dict[Tuple[Feature, SourceName], int] = {}
+
+
+def provider_deadline(feature: Feature, name: SourceName) -> float:
+    """
+    The adaptive deadline for a provider, in seconds.
+    Based on the provider's recent latencies and halved for every timeout in a row,
+    so a provider that is consistently slow stops holding up the feature.
+    The halving never goes below the provider's usual latency,
+    and every `PROBE_EVERY` timeouts in a row the provider gets the `max_deadline` once.
+    """
+    policy = deadline_policies[feature]
+    key = f'{feature}.{name}'
+    timeouts = _consecutive_timeouts.get((feature, name), 0)
+    if timeouts and timeouts % PROBE_EVERY == 0:
+        return policy['max_deadline']
+    deadline = policy['max_deadline']
+    floor = policy['min_deadline']
+    if Metrics.sample_count(key) >= MIN_SAMPLES:
+        latency = Metrics.percentile(key, policy['percentile']) or 0
+        deadline = latency * policy['multiplier']
+        floor = max(floor, latency)
+    deadline = max(floor, deadline / (2 ** timeouts))
+    return max(policy['min_deadline'], min(deadline, policy['max_deadline']))
+
+
+def is_useful(result: Any) -> bool:
+    return result is not None and result != []
+
+
+async def fan_out(feature: Feature, providers: List[P], request: Callable[[P], Awaitable[T]]) -> list[tuple[SourceName, T | None]]:
+    """
+    Cancels the previous requests of the providers, then calls `request` for each provider concurrently.
+    Each provider gets its own deadline, see `provider_deadline`.
+    Results are returned in the order of `providers`, `None` for providers that failed or timed out.
+    """
+    for provider in providers:
+        await provider.cancel()  # type: ignore
+
+    results: dict[int, T | None] = {}
+
+    async def handle(index: int, provider: Any) -> bool:
+        name: SourceName = provider.name
+        deadline = provider_deadline(feature, name)
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(request(provider), deadline)
+        except asyncio.TimeoutError:
+            _consecutive_timeouts[(feature, name)] = _consecutive_timeouts.get((feature, name), 0) + 1
+            Metrics.increment(f'{feature}.{name}.timeout')
+            # the provider took at least this long, so the deadline can not shrink below what it needs
+            Metrics.record_latency(f'{feature}.{name}', deadline)
+            await provider.cancel()
+            mir_logger.info(f'Mir ({name}) {feature} timed out after {deadline:.2f}s.')
+            results[index] = None
+            return False
+        except asyncio.CancelledError:
+            Metrics.increment(f'{feature}.{name}.cancelled')
+            await provider.cancel()
+            raise
+        except Exception as e:
+            Metrics.increment(f'{feature}.{name}.error')
+            await provider.cancel()
+            mir_logger.error(f'Error happened in provider {name}', exc_info=e)
+            results[index] = None
+            return False
+        _consecutive_timeouts.pop((feature, name), None)
+        Metrics.record_latency(f'{feature}.{name}', time.perf_counter() - start)
+        results[index] = result
+        return is_useful(result)
+
+    pending = {asyncio.ensure_future(handle(index, provider)) for index, provider in enumerate(providers)}
+    grace = deadline_policies[feature]['grace_after_first_result']
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if grace is not None and any(not task.cancelled() and task.exception() is None and task.result() for task in done):
+                if pending:
+                    _, pending = await asyncio.wait(pending, timeout=grace)
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    return [(provider.name, results.get(index)) for index, provider in enumerate(providers)]  # type: ignore
@@ -2,59 +2,290 @@ from __future__ import annotations
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import sublime
-from wcmatch.glob import globmatch, GLOBSTAR
-from Mir.types.lsp import CreateFilesParams, RenameFilesParams, DeleteFilesParams, DidChangeWatchedFilesParams, FileChangeType
+from wcmatch.glob import escape, translate, BRACE, GLOBSTAR
+from Mir.types.lsp import CreateFilesParams, RenameFilesParams, DeleteFilesParams, DidChangeWatchedFilesParams, FileChangeType, FileRename, WatchKind
 from .view_to_lsp import file_name_to_uri
-from typing import TypedDict, Callable
+from .metrics import Metrics
+from .inotify_observer import InotifyObserver, is_inotify_available
+from typing import Dict, List, Tuple, TypedDict, Callable
+import asyncio
+import os
 import posixpath
+import re
+import sublime_aio
+import threading
 from typing_extensions import NotRequired
 
-file_watchers = []
+WATCHED_FILES_BATCH_WINDOW = 100 # ms
+
+RegistrationKey = Tuple[int, str]
+""" The id of the server object and the registration id. """
+
+
+def canonical_folder(folder_name: str) -> str:
+    return os.path.normcase(os.path.normpath(folder_name))
+
+
+class FileWatchers:
+    """
+    One watcher per folder tree, shared by every server and window.
+    A folder inside of an already watched folder uses the outer watcher.
+    A watcher is stopped when its last registration is unregistered.
+    """
+    # canonical folder -> watcher
+    watchers: Dict[str, FileWatcher] = {}
+    # registration -> canonical folder of the watcher that has it
+    registrations: Dict[RegistrationKey, List[str]] = {}
+
+    @staticmethod
+    def register(folder_name: str, key: RegistrationKey, config: FileWatcherRegistrationOptions):
+        folder = canonical_folder(folder_name)
+        watcher_folder = next(iter([f for f in FileWatchers.watchers if is_same_or_inside(folder, f)]), None)
+        if watcher_folder is None:
+            watcher_folder = folder
+            watcher = create_file_watcher(os.path.normpath(folder_name))
+            # merge the watchers of nested folders into the new one
+            for nested_folder in [f for f in FileWatchers.watchers if is_same_or_inside(f, folder)]:
+                nested = FileWatchers.watchers.pop(nested_folder)
+                nested.stop()
+                for nested_key, nested_config in nested.registar.items():
+                    watcher.register(nested_key, nested_config)
+                    FileWatchers.registrations[nested_key] = [watcher_folder if f == nested_folder else f for f in FileWatchers.registrations[nested_key]]
+            FileWatchers.watchers[watcher_folder] = watcher
+        FileWatchers.watchers[watcher_folder].register(key, config)
+        FileWatchers.registrations.setdefault(key, [])
+        if watcher_folder not in FileWatchers.registrations[key]:
+            FileWatchers.registrations[key].append(watcher_folder)
+        FileWatchers._update_metrics()
+
+    @staticmethod
+    def register_folders(key: RegistrationKey, config: FileWatcherRegistrationOptions):
+        """ Registers the config for each of its `folders`, and for the bases of relative patterns outside of them. """
+        folders = config['folders']
+        bases = [w['base'] for w in config['watchers'] if 'base' in w]
+        watch_folders = folders + [b for b in bases if not any(is_same_or_inside(canonical_folder(b), canonical_folder(f)) for f in folders)]
+        for folder_name in dict.fromkeys(watch_folders):
+            FileWatchers.register(folder_name, key, config)
+
+    @staticmethod
+    def change_folders(server_id: int, folders: list[str]):
+        """
+        Moves the registrations of a server to new workspace folders, see `LanguageServer.reattach`.
+        The configs are changed in place, so the `unregister` calls in `before_shutdown` still match them.
+        """
+        for key in [k for k in FileWatchers.registrations if k[0] == server_id]:
+            watchers = [FileWatchers.watchers[f] for f in FileWatchers.registrations[key] if f in FileWatchers.watchers]
+            config = next(iter([w.registar[key] for w in watchers if key in w.registar]), None)
+            FileWatchers.unregister(key)
+            if config is None:
+                continue
+            config['folders'] = folders
+            FileWatchers.register_folders(key, config)
+
+    @staticmethod
+    def unregister(key: RegistrationKey, config: FileWatcherRegistrationOptions | None = None):
+        """ If `config` is given, the registration is only removed if it is still the same one. """
+        for watcher_folder in FileWatchers.registrations.pop(key, []):
+            watcher = FileWatchers.watchers.get(watcher_folder)
+            if watcher is None or key not in watcher.registar:
+                continue
+            if config is not None and watcher.registar[key] is not config:
+                FileWatchers.registrations.setdefault(key, []).append(watcher_folder)
+                continue
+            watcher.unregister(key)
+            if not watcher.registar:
+                watcher.stop()
+                del FileWatchers.watchers[watcher_folder]
+        FileWatchers._update_metrics()
+
+    @staticmethod
+    def _update_metrics():
+        Metrics.set_gauge('file_watcher.watchers', len(FileWatchers.watchers))
+        Metrics.set_gauge('file_watcher.registrations', len(FileWatchers.registrations))
+
+
+def is_same_or_inside(folder: str, parent: str) -> bool:
+    return folder == parent or folder.startswith(parent.rstrip(os.sep) + os.sep)
+
+
 def create_file_watcher(folder_name: str):
-    global file_watchers
-    ignore_patterns = get_global_ignore_globs()
-    file_watcher = FileWatcher(folder_name, ignore_patterns=ignore_patterns)
+    folder_exclude_patterns, file_exclude_patterns = get_global_exclude_patterns()
+    file_watcher = FileWatcher(folder_name, ignore_patterns=file_exclude_patterns, ignore_folder_patterns=folder_exclude_patterns)
     file_watcher.start()
-    file_watchers.append(file_watcher)
     return file_watcher
 
-def get_file_watcher(folder_name: str) -> FileWatcher | None:
-    global file_watchers
-    found_watchers = [fw for fw in file_watchers if fw.folder_name == folder_name]
-    if found_watchers:
-        return found_watchers[0]
-    return None
 
+class WatchPattern(TypedDict):
+    glob_pattern: str
+    kind: int
+    """ A `WatchKind` bitmask. """
+    base: NotRequired[str]
+    """ The folder of a relative pattern. Without it, the pattern is matched in each of the registration `folders`. """
 
-def remove_file_watcher(folder_name: str):
-    global file_watchers
-    for i, file_watcher in enumerate(list(file_watchers)):
-        if file_watcher.folder_name == folder_name:
-            file_watcher.stop()
-            file_watchers.pop(i)
 
 class FileWatcherRegistrationOptions(TypedDict):
-    glob_patterns: list[str]
+    folders: list[str]
+    watchers: list[WatchPattern]
     on_did_create_files: NotRequired[Callable[[CreateFilesParams], None]]
     on_did_rename_files: NotRequired[Callable[[RenameFilesParams], None]]
     on_did_delete_files: NotRequired[Callable[[DeleteFilesParams], None]]
     on_did_change_watched_files: NotRequired[Callable[[DidChangeWatchedFilesParams], None]]
 
+def merge_change(previous: FileChangeType | None, current: FileChangeType) -> FileChangeType | None:
+    """ The change that has the same effect as `previous` followed by `current`, None if they cancel out. """
+    if previous is None:
+        return current
+    if previous == FileChangeType.Created:
+        return None if current == FileChangeType.Deleted else FileChangeType.Created
+    if previous == FileChangeType.Deleted:
+        return FileChangeType.Deleted if current == FileChangeType.Deleted else FileChangeType.Changed
+    return FileChangeType.Deleted if current == FileChangeType.Deleted else FileChangeType.Changed
+
+
+class FileEventBatch:
+    """
+    Collects the file system events of one registration for `window` seconds,
+    then sends them in one notification per kind from the event loop.
+    A file that is created and deleted within the window is not reported, repeated changes are reported once.
+    """
+    def __init__(self, config: FileWatcherRegistrationOptions, window: float):
+        self.config = config
+        self.window = window
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._changes: dict[str, FileChangeType] = {}
+        self._created: dict[str, None] = {}
+        self._deleted: dict[str, None] = {}
+        self._renamed: list[FileRename] = []
+
+    def created(self, uri: str, watched: bool = True):
+        with self._lock:
+            self._created[uri] = None
+            if watched:
+                self._change(uri, FileChangeType.Created)
+            self._schedule()
+
+    def changed(self, uri: str):
+        with self._lock:
+            self._change(uri, FileChangeType.Changed)
+
+    def deleted(self, uri: str, watched: bool = True):
+        with self._lock:
+            if uri in self._created:
+                del self._created[uri]
+            else:
+                self._deleted[uri] = None
+            if watched:
+                self._change(uri, FileChangeType.Deleted)
+            self._schedule()
+
+    def renamed(self, old_uri: str, new_uri: str, watched_delete: bool = False, watched_create: bool = False):
+        with self._lock:
+            if old_uri in self._created:
+                # the server never heard of the old file
+                del self._created[old_uri]
+                self._created[new_uri] = None
+            else:
+                self._renamed.append({'oldUri': old_uri, 'newUri': new_uri})
+            if watched_delete:
+                self._change(old_uri, FileChangeType.Deleted)
+            if watched_create:
+                self._change(new_uri, FileChangeType.Created)
+            self._schedule()
+
+    def _change(self, uri: str, change_type: FileChangeType):
+        change = merge_change(self._changes.pop(uri, None), change_type)
+        if change is not None:
+            self._changes[uri] = change
+        self._schedule()
+
+    def _schedule(self):
+        if self._scheduled:
+            return
+        self._scheduled = True
+        sublime_aio.run_coroutine(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        with self._lock:
+            self._scheduled = False
+            changes, self._changes = self._changes, {}
+            created, self._created = self._created, {}
+            deleted, self._deleted = self._deleted, {}
+            renamed, self._renamed = self._renamed, []
+        on_did_rename_files = self.config.get('on_did_rename_files')
+        if renamed and on_did_rename_files:
+            on_did_rename_files({'files': renamed})
+        on_did_delete_files = self.config.get('on_did_delete_files')
+        if deleted and on_did_delete_files:
+            on_did_delete_files({'files': [{'uri': uri} for uri in deleted]})
+        on_did_create_files = self.config.get('on_did_create_files')
+        if created and on_did_create_files:
+            on_did_create_files({'files': [{'uri': uri} for uri in created]})
+        on_did_change_watched_files = self.config.get('on_did_change_watched_files')
+        if changes and on_did_change_watched_files:
+            Metrics.increment('file_watcher.notifications')
+            Metrics.increment('file_watcher.changes', len(changes))
+            on_did_change_watched_files({'changes': [{'uri': uri, 'type': change_type} for uri, change_type in changes.items()]})
+
+
+class GlobMatcher:
+    """ Glob patterns compiled once into a single regex. """
+    def __init__(self, patterns: list[str]):
+        regexes: list[str] = []
+        for pattern in patterns:
+            include, _ = translate(pattern, flags=GLOBSTAR | BRACE)
+            regexes.extend(include)
+        self.regex = re.compile('|'.join(regexes)) if regexes else None
+
+    def matches(self, path: str) -> bool:
+        return self.regex is not None and self.regex.match(path) is not None
+
+
+_GLOB_CHARACTERS = re.compile(r'[*?\[\]{}/]')
+_PATH_SEPARATORS = re.compile(r'[\\/]')
+
+
 class FileWatcher(FileSystemEventHandler):
-    def __init__(self, folder_name, ignore_patterns):
+    def __init__(self, folder_name, ignore_patterns, ignore_folder_patterns=[]):
         self.folder_name: str = folder_name
         self.watch_patterns: list[str] = []
-        self.ignore_patterns: list[str] = [sublime_pattern_to_glob(p, False, folder_name) for p in ignore_patterns]
-        self.observer = Observer()
-        self.observer.schedule(self, folder_name, recursive=True)
-        self.registar: dict[str, FileWatcherRegistrationOptions] = {}
+        self.ignore_patterns: list[str] = [sublime_pattern_to_glob(p, False, folder_name) for p in ignore_patterns] + \
+            [sublime_pattern_to_glob(p, True, folder_name) for p in ignore_folder_patterns]
+        self.ignore_matcher = GlobMatcher(self.ignore_patterns)
+        # folder names like `node_modules` or `.git`, a path inside of them is rejected without running the ignore regex
+        self.ignored_folder_names = {p for p in ignore_folder_patterns if not _GLOB_CHARACTERS.search(p)}
+        # (folder, `WatchKind` bitmask, matcher) for each registration, a pattern only matches inside of its folder
+        self.matchers: dict[RegistrationKey, list[tuple[str, int, GlobMatcher]]] = {}
+        self.observer: Observer | InotifyObserver
+        if is_inotify_available():
+            # the recursive inotify observer would also watch every folder in `node_modules`
+            self.observer = InotifyObserver(folder_name, self.on_any_event, self.is_ignored_folder)
+        else:
+            self.observer = Observer()
+            self.observer.schedule(self, folder_name, recursive=True)
+        self.registar: dict[RegistrationKey, FileWatcherRegistrationOptions] = {}
+        self.batches: dict[RegistrationKey, FileEventBatch] = {}
 
-    def register(self, key: str, config: FileWatcherRegistrationOptions):
+    def register(self, key: RegistrationKey, config: FileWatcherRegistrationOptions):
+        groups: dict[tuple[str, int], list[str]] = {}
+        for watcher in config['watchers']:
+            base = watcher.get('base')
+            roots = [base] if base else config['folders']
+            for root in roots:
+                if not is_same_or_inside(canonical_folder(root), canonical_folder(self.folder_name)):
+                    continue
+                glob_pattern = f"{escape(root.replace(os.sep, '/')).rstrip('/')}/{watcher['glob_pattern']}" if base else sublime_pattern_to_glob(watcher['glob_pattern'], False, root)
+                groups.setdefault((os.path.normpath(root), watcher['kind']), []).append(glob_pattern)
         self.registar[key] = config
-        self.registar[key]['glob_patterns'] = [sublime_pattern_to_glob(p, False, self.folder_name) for p in config['glob_patterns']]
+        self.matchers[key] = [(root, kind, GlobMatcher(patterns)) for (root, kind), patterns in groups.items()]
+        batch_window = sublime.load_settings('Mir.sublime-settings').get('mir.watched_files_batch_window', WATCHED_FILES_BATCH_WINDOW)
+        self.batches[key] = FileEventBatch(config, batch_window / 1000)
 
-    def unregister(self, key: str):
+    def unregister(self, key: RegistrationKey):
         del self.registar[key]
+        del self.batches[key]
+        del self.matchers[key]
 
     def start(self):
         self.observer.start()
@@ -66,79 +297,54 @@ class FileWatcher(FileSystemEventHandler):
         # Check if the file should be processed
         if event.is_directory and event.event_type == 'modified':
             return
-        for key, config in self.registar.items():
-            if self.matches_patterns(event.src_path, config['glob_patterns']) and not self.matches_patterns(event.src_path, self.ignore_patterns):
-                self.handle_event(event, config)
-
-    def handle_event(self, event, config: FileWatcherRegistrationOptions):
-        """Handle the file system event (customize this method)."""
-        if event.event_type == 'deleted':
-            uri = file_name_to_uri(event.src_path)
-            delete_params: DeleteFilesParams = {
-                'files': [{
-                    'uri': uri
-                }]
-            }
-            on_did_delete_files = config.get('on_did_delete_files')
-            if on_did_delete_files:
-                on_did_delete_files(delete_params)
-            did_change_params: DidChangeWatchedFilesParams = {
-                'changes': [{
-                    'uri': uri,
-                    'type': FileChangeType.Deleted
-                }]
-            }
-            on_did_change_watched_files = config.get('on_did_change_watched_files')
-            if on_did_change_watched_files:
-                on_did_change_watched_files(did_change_params)
-
-        elif event.event_type == 'created':
-            uri = file_name_to_uri(event.src_path)
-            create_params: CreateFilesParams = {
-                'files': [{
-                    'uri': uri
-                }]
-            }
-            on_did_create_files = config.get('on_did_create_files')
-            if on_did_create_files:
-                on_did_create_files(create_params)
-            did_change_params: DidChangeWatchedFilesParams = {
-                'changes': [{
-                    'uri': uri,
-                    'type': FileChangeType.Created
-                }]
-            }
-            on_did_change_watched_files = config.get('on_did_change_watched_files')
-            if on_did_change_watched_files:
-                on_did_change_watched_files(did_change_params)
-
-        elif event.event_type == 'modified':
-            uri = file_name_to_uri(event.src_path)
-            did_change_params: DidChangeWatchedFilesParams = {
-                'changes': [{
-                    'uri': uri,
-                    'type': FileChangeType.Changed
-                }]
-            }
-            on_did_change_watched_files = config.get('on_did_change_watched_files')
-            if on_did_change_watched_files:
-                on_did_change_watched_files(did_change_params)
+        src_ignored = self.is_ignored(event.src_path)
+        dest_path = event.dest_path if event.event_type == 'moved' else ''
+        dest_ignored = not dest_path or self.is_ignored(dest_path)
+        if src_ignored and dest_ignored:
+            return
+        for key in list(self.matchers):
+            batch = self.batches.get(key)
+            if not batch:
+                continue
+            kinds = 0 if src_ignored else self.match_kinds(key, event.src_path)
+            dest_kinds = 0 if dest_ignored else self.match_kinds(key, dest_path)
+            if kinds or dest_kinds:
+                self.handle_event(event, batch, kinds, dest_kinds)
+
+    def match_kinds(self, key: RegistrationKey, path: str) -> int:
+        """ The `WatchKind`s the registration wants for the path, 0 if no pattern matches. """
+        kinds = 0
+        for root, kind, matcher in self.matchers.get(key, []):
+            if kinds | kind != kinds and is_same_or_inside(path, root) and matcher.matches(path):
+                kinds |= kind
+        return kinds
+
+    def is_ignored_folder(self, path: str) -> bool:
+        return self.is_ignored(path + '/')
+
+    def is_ignored(self, path: str) -> bool:
+        if self.ignored_folder_names:
+            relative_path = path[len(self.folder_name):] if path.startswith(self.folder_name) else path
+            folders = _PATH_SEPARATORS.split(relative_path)[:-1]
+            if not self.ignored_folder_names.isdisjoint(folders):
+                return True
+        return self.ignore_matcher.matches(path)
+
+    def handle_event(self, event, batch: FileEventBatch, kinds: int, dest_kinds: int = 0):
+        """
+        Runs on the watchdog thread, the batch sends the events later from the event loop.
+        Watched file changes are only queued for the `WatchKind`s the registration asked for.
+        """
+        if event.event_type == 'deleted' and kinds:
+            batch.deleted(file_name_to_uri(event.src_path), watched=bool(kinds & WatchKind.Delete))
+        elif event.event_type == 'created' and kinds:
+            batch.created(file_name_to_uri(event.src_path), watched=bool(kinds & WatchKind.Create))
+        elif event.event_type == 'modified' and kinds & WatchKind.Change:
+            batch.changed(file_name_to_uri(event.src_path))
         elif event.event_type == 'moved':
-            old_uri = file_name_to_uri(event.src_path)
-            new_uri = file_name_to_uri(event.dest_path)
-            rename_params: RenameFilesParams = {
-                'files': [{
-                    'oldUri': old_uri,
-                    'newUri': new_uri,
-                }]
-            }
-            on_did_rename_files = config.get('on_did_rename_files')
-            if on_did_rename_files:
-                on_did_rename_files(rename_params)
-
-    def matches_patterns(self, file_path, patterns):
-        """Check if the file path matches any of the given patterns using wcmatch."""
-        return any(globmatch(file_path, pattern, flags=GLOBSTAR) for pattern in patterns)
+            # for watched files a move is a delete and a create
+            batch.renamed(file_name_to_uri(event.src_path), file_name_to_uri(event.dest_path),
+                watched_delete=bool(kinds & WatchKind.Delete), watched_create=bool(dest_kinds & WatchKind.Create))
 
 
 def sublime_pattern_to_glob(pattern: str, is_directory_pattern: bool, root_path: str | None = None) -> str:
@@ -172,8 +378,9 @@ def sublime_pattern_to_glob(pattern: str, is_directory_pattern: bool, root_path:
     return glob
 
 
-def get_global_ignore_globs() -> list[str]:
+def get_global_exclude_patterns() -> tuple[list[str], list[str]]:
+    """ Returns the folder and the file exclude patterns, in the Sublime Text format. """
     globalprefs = sublime.active_window().active_view().settings()
     folder_exclude_patterns: list[str] = globalprefs.get('folder_exclude_patterns', [])
     file_exclude_patterns: list[str] = globalprefs.get('file_exclude_patterns', [])
-    return folder_exclude_patterns + file_exclude_patterns + ['**/node_modules/**']
+    return folder_exclude_patterns + ['node_modules'], file_exclude_patterns
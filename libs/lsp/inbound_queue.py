@@ -0,0 +1,71 @@
+from __future__ import annotations
+from collections import deque
+from enum import IntEnum
+from typing import Deque, List
+import asyncio
+
+
+class Priority(IntEnum):
+    Interactive = 0
+    """ Responses the user is waiting for, like hover or completions. """
+    Normal = 1
+    """ Other responses and requests from the server. """
+    Background = 2
+    """ High volume notifications, like diagnostics, progress and logs. """
+
+
+INTERACTIVE_METHODS = {
+    'textDocument/hover',
+    'textDocument/completion',
+    'completionItem/resolve',
+    'textDocument/definition',
+    'textDocument/signatureHelp',
+}
+""" Responses to these requests are handled before anything else. """
+
+BACKGROUND_METHODS = {
+    'textDocument/publishDiagnostics',
+    '$/progress',
+    '$/logTrace',
+    'window/logMessage',
+    'telemetry/event',
+}
+""" These notifications are handled in bounded batches. """
+
+BACKGROUND_BATCH_SIZE = 20
+
+
+class InboundQueue:
+    """
+    Decoded (or decoding) payloads received from a server.
+    Each batch contains every interactive payload, then every normal payload,
+    then at most `BACKGROUND_BATCH_SIZE` background payloads.
+    Payloads with the same priority keep the order in which they were read.
+    """
+    def __init__(self) -> None:
+        self._queues: List[Deque[asyncio.Future]] = [deque() for _ in Priority]
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def put(self, priority: Priority, decoded: asyncio.Future) -> None:
+        self._queues[priority].append(decoded)
+        self._ready.set()
+
+    def close(self) -> None:
+        """ `next_batch` returns None once the remaining payloads are handled. """
+        self._closed = True
+        self._ready.set()
+
+    async def next_batch(self) -> list[asyncio.Future] | None:
+        while not any(self._queues):
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        interactive, normal, background = self._queues
+        batch = list(interactive) + list(normal)
+        interactive.clear()
+        normal.clear()
+        for _ in range(min(BACKGROUND_BATCH_SIZE, len(background))):
+            batch.append(background.popleft())
+        return batch
@@ -0,0 +1,262 @@
+from __future__ import annotations
+from Mir import mir_logger
+from .metrics import Metrics
+from typing import Callable, Dict, List, Tuple
+from watchdog.events import DirCreatedEvent, DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent, FileSystemEvent
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+MOVE_PAIR_TIMEOUT = 0.1
+""" Seconds an IN_MOVED_FROM waits for its IN_MOVED_TO (they can arrive in different reads) before it is reported as deleted. """
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return _libc
+
+
+def is_inotify_available() -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_load_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class InotifyObserver:
+    """
+    Watches a folder tree with one inotify watch per folder.
+    Unlike the recursive watchdog observer, folders for which `is_excluded` returns True
+    (like `node_modules`) never get a watch, so they do not count against `max_user_watches`.
+    Folders created later are watched as they appear, the files in them are reported as created.
+
+    Events are delivered as watchdog events to `on_event`, on the observer thread.
+    """
+    def __init__(self, folder_name: str, on_event: Callable[[FileSystemEvent], None], is_excluded: Callable[[str], bool]):
+        self.folder_name = folder_name
+        self.on_event = on_event
+        self.is_excluded = is_excluded
+        self._fd = -1
+        self._stop_read, self._stop_write = -1, -1
+        self._thread: threading.Thread | None = None
+        self._paths: Dict[int, str] = {}
+        self._wds: Dict[str, int] = {}
+        self._out_of_watches = False
+        # cookie -> (path, is a folder, time) of IN_MOVED_FROM events waiting for their IN_MOVED_TO
+        self._moved_from: Dict[int, Tuple[str, bool, float]] = {}
+        # guards the stop pipe, `stop` can be called while `_run` closes it
+        self._lock = threading.Lock()
+
+    def start(self):
+        libc = _load_libc()
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = threading.Thread(target=self._run, name=f'mir-inotify {self.folder_name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._stop_write >= 0:
+                os.write(self._stop_write, b'x')
+
+    @property
+    def watch_count(self) -> int:
+        return len(self._paths)
+
+    def _run(self):
+        try:
+            self._watch_tree(self.folder_name)
+            while True:
+                timeout = MOVE_PAIR_TIMEOUT if self._moved_from else None
+                readable, _, _ = select.select([self._fd, self._stop_read], [], [], timeout)
+                if self._stop_read in readable:
+                    break
+                events: List[FileSystemEvent] = []
+                if self._fd in readable:
+                    try:
+                        events = self._parse(os.read(self._fd, READ_SIZE))
+                    except InterruptedError:
+                        continue
+                for event in self._expire_moves() + events:
+                    try:
+                        self.on_event(event)
+                    except Exception as e:
+                        mir_logger.error(f'Mir: Error while handling {event}.', exc_info=e)
+        except Exception as e:
+            mir_logger.error(f'Mir: The file watcher for {self.folder_name} stopped.', exc_info=e)
+        finally:
+            with self._lock:
+                for fd in (self._fd, self._stop_read, self._stop_write):
+                    if fd >= 0:
+                        os.close(fd)
+                self._fd = self._stop_read = self._stop_write = -1
+            self._moved_from.clear()
+            self._paths.clear()
+            self._wds.clear()
+            Metrics.remove_gauge(f'file_watcher.watches.{self.folder_name}')
+
+    def _add_watch(self, path: str) -> bool:
+        if self._out_of_watches:
+            return False
+        wd = _load_libc().inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                self._out_of_watches = True
+                mir_logger.error(f'Mir: Out of inotify watches while watching {self.folder_name}, increase fs.inotify.max_user_watches.')
+            return False
+        self._paths[wd] = path
+        self._wds[path] = wd
+        return True
+
+    def _watch_tree(self, root: str, created: List[FileSystemEvent] | None = None):
+        """
+        Adds a watch for `root` and every folder in it that is not excluded.
+        The files and folders found are added to `created`, if given.
+        """
+        folders = [root]
+        while folders:
+            folder = folders.pop()
+            if folder != self.folder_name and self.is_excluded(folder):
+                continue
+            if not self._add_watch(folder):
+                continue
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_folder = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_folder:
+                    folders.append(entry.path)
+                    if created is not None:
+                        created.append(DirCreatedEvent(entry.path))
+                elif created is not None:
+                    # created before the watch was added
+                    created.append(FileCreatedEvent(entry.path))
+        Metrics.set_gauge(f'file_watcher.watches.{self.folder_name}', self.watch_count)
+
+    def _unwatch_tree(self, root: str):
+        prefix = root + os.sep
+        for path in [p for p in self._wds if p == root or p.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            _load_libc().inotify_rm_watch(self._fd, wd)
+        Metrics.set_gauge(f'file_watcher.watches.{self.folder_name}', self.watch_count)
+
+    def _move_tree(self, old_root: str, new_root: str):
+        prefix = old_root + os.sep
+        for path in [p for p in self._wds if p == old_root or p.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            new_path = new_root + path[len(old_root):]
+            self._paths[wd] = new_path
+            self._wds[new_path] = wd
+
+    def _parse(self, data: bytes) -> List[FileSystemEvent]:
+        events: List[FileSystemEvent] = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0'))
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                Metrics.increment('file_watcher.overflows')
+                mir_logger.error(f'Mir: inotify queue overflow while watching {self.folder_name}, some file events were lost.')
+                continue
+            if mask & IN_IGNORED:
+                path = self._paths.pop(wd, None)
+                if path is not None and self._wds.get(path) == wd:
+                    del self._wds[path]
+                continue
+            folder = self._paths.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            is_folder = bool(mask & IN_ISDIR)
+            if mask & IN_CREATE:
+                if is_folder:
+                    events.append(DirCreatedEvent(path))
+                    if not self.is_excluded(path):
+                        self._watch_tree(path, events)
+                else:
+                    events.append(FileCreatedEvent(path))
+            elif mask & IN_DELETE:
+                if is_folder:
+                    self._unwatch_tree(path)
+                events.append(DirDeletedEvent(path) if is_folder else FileDeletedEvent(path))
+            elif mask & IN_MODIFY:
+                if not is_folder:
+                    events.append(FileModifiedEvent(path))
+            elif mask & IN_MOVED_FROM:
+                self._moved_from[cookie] = (path, is_folder, time.monotonic())
+            elif mask & IN_MOVED_TO:
+                source = self._moved_from.pop(cookie, None)
+                if source is None:
+                    # moved in from outside of the watched tree
+                    if is_folder:
+                        events.append(DirCreatedEvent(path))
+                        if not self.is_excluded(path):
+                            self._watch_tree(path, events)
+                    else:
+                        events.append(FileCreatedEvent(path))
+                    continue
+                source_path, _, _ = source
+                if is_folder:
+                    if self.is_excluded(path):
+                        self._unwatch_tree(source_path)
+                    elif source_path in self._wds:
+                        self._move_tree(source_path, path)
+                    else:
+                        self._watch_tree(path, events)
+                events.append(DirMovedEvent(source_path, path) if is_folder else FileMovedEvent(source_path, path))
+        return events
+
+    def _expire_moves(self) -> List[FileSystemEvent]:
+        """ The IN_MOVED_FROM events without an IN_MOVED_TO in time were moved out of the watched tree. """
+        events: List[FileSystemEvent] = []
+        now = time.monotonic()
+        for cookie, (source_path, is_folder, moved_at) in list(self._moved_from.items()):
+            if now - moved_at < MOVE_PAIR_TIMEOUT:
+                continue
+            del self._moved_from[cookie]
+            if is_folder:
+                self._unwatch_tree(source_path)
+            events.append(DirDeletedEvent(source_path) if is_folder else FileDeletedEvent(source_path))
+        return events
@@ -0,0 +1,106 @@
+from __future__ import annotations
+from .metrics import Metrics
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, Iterable, List, TYPE_CHECKING
+import sublime
+if TYPE_CHECKING:
+    from Mir.types.lsp import Position
+
+
+def utf16_column(line: str, column: int) -> int:
+    """ Converts a column in characters (Sublime) to a column in UTF-16 code units (LSP). """
+    if line.isascii():
+        return column
+    return len(line[:column].encode('utf-16-le')) // 2
+
+
+def column_from_utf16(line: str, character: int) -> int:
+    """ Converts a column in UTF-16 code units (LSP) to a column in characters (Sublime), clamped to the line. """
+    if line.isascii():
+        return min(character, len(line))
+    # a half of a surrogate pair is dropped, so a column in the middle of a character points before it
+    return len(line.encode('utf-16-le')[:character * 2].decode('utf-16-le', 'ignore'))
+
+
+class LineIndex:
+    """
+    A copy of the lines of a view with the points where they start.
+    Converts between Sublime points and LSP positions without asking Sublime for every position.
+    """
+    def __init__(self, text: str, change_count: int):
+        self.lines: List[str] = text.split('\n')
+        self.size = len(text)
+        self.change_count = change_count
+        self._line_starts: List[int] | None = None
+
+    @property
+    def line_starts(self) -> List[int]:
+        if self._line_starts is None:
+            # +1 for the '\n' at the end of every line
+            self._line_starts = [0, *accumulate(len(line) + 1 for line in self.lines[:-1])]
+        return self._line_starts
+
+    def apply(self, change: sublime.TextChange) -> None:
+        a, b = change.a, change.b
+        before = self.lines[a.row][:a.col]
+        after = self.lines[b.row][b.col:]
+        self.lines[a.row:b.row + 1] = (before + change.str + after).split('\n')
+        self.size += len(change.str) - (b.pt - a.pt)
+        self._line_starts = None
+
+    def point_to_position(self, point: int) -> Position:
+        point = max(0, min(point, self.size))
+        row = bisect_right(self.line_starts, point) - 1
+        return {
+            'line': row,
+            'character': utf16_column(self.lines[row], point - self.line_starts[row])
+        }
+
+    def position_to_point(self, position: Position) -> int:
+        row = position['line']
+        if row >= len(self.lines):
+            return self.size
+        return self.line_starts[row] + column_from_utf16(self.lines[row], position['character'])
+
+
+class LineIndexes:
+    """
+    A `LineIndex` per view, rebuilt when the view `change_count` differs
+    and kept up to date from the `TextChange` events of `MirTextChangeListener`.
+    """
+    indexes: Dict[int, LineIndex] = {}
+
+    @staticmethod
+    def get(view: sublime.View) -> LineIndex:
+        change_count = view.change_count()
+        index = LineIndexes.indexes.get(view.id())
+        if index is None or index.change_count != change_count:
+            index = LineIndex(view.substr(sublime.Region(0, view.size())), change_count)
+            LineIndexes.indexes[view.id()] = index
+            Metrics.increment('line_index.builds')
+        return index
+
+    @staticmethod
+    def on_text_changed(view: sublime.View, changes: Iterable[sublime.TextChange]) -> None:
+        index = LineIndexes.indexes.get(view.id())
+        if index is None:
+            return
+        change_count = view.change_count()
+        if index.change_count == change_count:
+            # built after these changes were made
+            return
+        try:
+            for change in changes:
+                index.apply(change)
+        except IndexError:
+            index.size = -1
+        if index.size != view.size():
+            # out of sync, rebuild on next use
+            LineIndexes.indexes.pop(view.id(), None)
+            return
+        index.change_count = change_count
+
+    @staticmethod
+    def invalidate(view: sublime.View) -> None:
+        LineIndexes.indexes.pop(view.id(), None)
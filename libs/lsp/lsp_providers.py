@@ -13,8 +13,8 @@ if TYPE_CHECKING:
 
 class LspProvider:
     def is_applicable(self):
-        # LSP Providers are only active for a given window
-        return self.server.window == sublime.active_window()
+        # LSP Providers are only active for the windows that use the server
+        return sublime.active_window() in self.server.windows
 
     def __init__(self, server: LanguageServer):
         self.server = server
@@ -22,6 +22,21 @@ class LspProvider:
         self.activation_events = self.server.activation_events
         self._requests: list[Request]=[]
 
+    def _track(self, request: Request) -> Request:
+        """ Keep the request until it is done, so `cancel` can cancel it. """
+        self._requests.append(request)
+        request.result.add_done_callback(lambda _: self._untrack(request))
+        return request
+
+    def _untrack(self, request: Request) -> None:
+        self._requests = [r for r in self._requests if r is not request]
+
+    async def cancel(self):
+        requests = self._requests
+        self._requests = []
+        for request in requests:
+            request.cancel()
+
 class LspDefinitionProvider(LspProvider, DefinitionProvider):
     async def provide_definition(self, view: sublime.View, point: int) -> Definition | list[LocationLink] | None:
         uri = get_view_uri(view)
@@ -31,15 +46,9 @@ class LspDefinitionProvider(LspProvider, DefinitionProvider):
             },
             'position': point_to_position(view, point)
         })
-        self._requests.append(req)
+        self._track(req)
         return await req.result
 
-    async def cancel(self):
-        if self._requests:
-            for request in self._requests:
-                request.cancel()
-        self._requests = []
-
 
 class LspReferencesProvider(LspProvider, ReferencesProvider):
     async def provide_references(self, view: sublime.View, point: int) -> list[Location] | None:
@@ -49,15 +58,9 @@ class LspReferencesProvider(LspProvider, ReferencesProvider):
             'textDocument': {'uri': uri },
             'position': point_to_position(view, point)
         })
-        self._requests.append(req)
+        self._track(req)
         return await req.result
 
-    async def cancel(self):
-        if self._requests:
-            for request in self._requests:
-                request.cancel()
-        self._requests = []
-
 class LspCodeActionProvider(LspProvider, CodeActionProvider):
     async def provide_code_actions(self, view: sublime.View, region: sublime.Region, context: CodeActionContext) -> list[Command | CodeAction] | None:
         uri = get_view_uri(view)
@@ -66,15 +69,9 @@ class LspCodeActionProvider(LspProvider, CodeActionProvider):
             'range': region_to_range(view, region),
             'context': context
         })
-        self._requests.append(req)
+        self._track(req)
         return await req.result
 
-    async def cancel(self):
-        if self._requests:
-            for request in self._requests:
-                request.cancel()
-        self._requests = []
-
 
 
 class LspCompletionProvider(LspProvider, CompletionProvider):
@@ -87,23 +84,17 @@ class LspCompletionProvider(LspProvider, CompletionProvider):
             },
             'position': point_to_position(view, point)
         })
-        self._requests.append(req)
+        self._track(req)
         return await req.result
 
     async def resolve_completion_item(self, completion_item) -> CompletionItem:
         if not self.server.capabilities.has('completionProvider.resolveProvider'):
             return completion_item
         req = self.server.send.resolve_completion_item(completion_item)
-        self._requests.append(req)
+        self._track(req)
         resolved_completion_item = await req.result
         return resolved_completion_item
 
-    async def cancel(self):
-        if self._requests:
-            for request in self._requests:
-                request.cancel()
-        self._requests = []
-
 
 class LspHoverProvider(LspProvider, HoverProvider):
     async def provide_hover(self, view: sublime.View, hover_point: int, hover_zone: sublime.HoverZone) -> Hover | None:
@@ -114,15 +105,9 @@ class LspHoverProvider(LspProvider, HoverProvider):
             },
             'position': point_to_position(view, hover_point)
         })
-        self._requests.append(req)
+        self._track(req)
         return await req.result
 
-    async def cancel(self):
-        if self._requests:
-            for request in self._requests:
-                request.cancel()
-        self._requests = []
-
 
 class LspDocumentSymbolProvider(LspProvider, DocumentSymbolProvider):
     async def provide_document_symbol(self, view: sublime.View) -> list[SymbolInformation] | list[DocumentSymbol] | None:
@@ -132,15 +117,9 @@ class LspDocumentSymbolProvider(LspProvider, DocumentSymbolProvider):
                 'uri': uri
             },
         })
-        self._requests.append(req)
+        self._track(req)
         return await req.result
 
-    async def cancel(self):
-        if self._requests:
-            for request in self._requests:
-                request.cancel()
-        self._requests = []
-
 
 capabilities_to_lsp_providers: dict[ServerCapability, type[LspProvider]] = {
     'definitionProvider': LspDefinitionProvider,
@@ -12,7 +12,7 @@ if TYPE_CHECKING:
 
 T = TypeVar('T')
 class Request(Generic[T]):
-    def __init__(self, server: LanguageServer, id: int, method='', params=None) -> None:
+    def __init__(self, server: LanguageServer, id: int, method='', params=None, timeout: float | None = None) -> None:
         self.server: LanguageServer = server
         self.result: asyncio.Future[T] = asyncio.Future()
         self.id: int = id
@@ -20,6 +20,11 @@ class Request(Generic[T]):
         self.params = params
         self.request_start_time = datetime.datetime.now()
         self.request_end_time: datetime.datetime | None = None
+        self._abandoned = False
+        self._timeout_handle: asyncio.TimerHandle | None = None
+        if timeout is not None:
+            self._timeout_handle = self.result.get_loop().call_later(timeout, self._on_timeout, timeout)
+        self.result.add_done_callback(self._on_done)
 
     @property
     def duration(self):
@@ -31,11 +36,31 @@ class Request(Generic[T]):
         if self.request_end_time is not None:
             # ignore canceling finished requests
             return
-        self.server.notify.cancel_request({
-            'id': self.id
-        })
+        self._abandon()
         self.result.cancel()
 
+    def _abandon(self):
+        """ Tell the server that nobody waits for the response anymore and drop the response handler. """
+        if self._abandoned:
+            return
+        self._abandoned = True
+        if self._timeout_handle:
+            self._timeout_handle.cancel()
+        self.server.abandon_request(self.id)
+
+    def _on_timeout(self, timeout: float):
+        if self.result.done():
+            return
+        self._abandon()
+        self.result.set_exception(asyncio.TimeoutError(f'"{self.method}" ({self.id}) did not get a response in {timeout}s.'))
+
+    def _on_done(self, future: asyncio.Future):
+        if self._timeout_handle:
+            self._timeout_handle.cancel()
+        # the future can be cancelled without calling `cancel()`, for example by `asyncio.wait_for`
+        if future.cancelled() and self.request_end_time is None:
+            self._abandon()
+
 class LspRequest:
     def __init__(self, send_request):
         self.send_request = send_request
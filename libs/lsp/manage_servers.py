@@ -2,12 +2,14 @@ from __future__ import annotations
 
 from Mir import mir_logger
 
-from .pull_diagnostics import pull_diagnostics
 import sublime_aio
-from .view_to_lsp import get_view_uri, view_to_text_document_item
-from .server import LanguageServer, matches_activation_event_on_uri, is_applicable_view
-from .file_watcher import remove_file_watcher
+from .server import LanguageServer, matches_activation_event_on_uri, is_applicable_view, settings_hash, workspace_folders_for_window
+from .providers import Providers
+from .line_index import LineIndexes
 from .capabilities import ServerCapability
+from .warm_pool import WarmPool
+from .metrics import Metrics
+from .process_watchdog import ProcessWatchdog
 import sublime
 
 
@@ -36,6 +38,16 @@ async def open_document(view: sublime.View):
         if not is_applicable_view(view, server.activation_events):
             continue
         if server.name not in [s.name for s in ManageServers.servers_for_view(view)]:
+            shared_server = ManageServers.shared_server(server, view)
+            if shared_server:
+                ManageServers.attach_server_to_window(shared_server, window)
+                Metrics.increment('servers.shared')
+                continue
+            warm_server = WarmPool.take(server, view)
+            if warm_server:
+                ManageServers.attach_server_to_window(warm_server, window)
+                warm_server.reattach(view)
+                continue
             new_server = server()
             ManageServers.attach_server_to_window(new_server, window)
             try:
@@ -45,30 +57,21 @@ async def open_document(view: sublime.View):
                 mir_logger.error(f'Mir ({server.name}) | Error while starting.', exc_info=e)
                 continue
     for server in servers_for_view(view):
-        text_document = view_to_text_document_item(view)
-        server.notify.did_open_text_document({
-            'textDocument': text_document
-        })
-        server.open_views.append(view)
-        sublime_aio.run_coroutine(pull_diagnostics(server, text_document['uri']))
+        server.open_view(view)
 
 
 def close_document(view: sublime.View):
     for server in servers_for_view(view):
-        server.notify.did_close_text_document({
-            'textDocument': {
-                'uri': get_view_uri(view)
-            }
-        })
-        server.open_views = [v for v in server.open_views if v.id() != view.id()]
+        server.close_view(view)
         if server.activation_events.get('on_uri'): # close servers who specify on_uri activation event
             window = view.window()
             if not window:
                 continue
             relevant_views = [matches_activation_event_on_uri(view, server.activation_events) for view in window.views()]
             if len(relevant_views) <= 1:
-                server.stop()
                 ManageServers.detach_server_from_window(server, window)
+                if not server.windows:
+                    server.stop()
 
 
 class ManageServers(sublime_aio.EventListener):
@@ -86,20 +89,57 @@ class ManageServers(sublime_aio.EventListener):
     def servers_for_window(cls, window: sublime.Window):
         return [s for s in ManageServers.language_servers_per_window.get(window.id(), [])]
 
+    @classmethod
+    def all_servers(cls) -> list[LanguageServer]:
+        """ Every running server once, even if it is shared by several windows. """
+        servers: dict[int, LanguageServer] = {}
+        for window_servers in ManageServers.language_servers_per_window.values():
+            for server in window_servers:
+                servers[id(server)] = server
+        return list(servers.values())
+
+    @classmethod
+    def shared_server(cls, server_class: type[LanguageServer], view: sublime.View) -> LanguageServer | None:
+        """
+        A server started by another window with the same workspace folders and settings,
+        if `mir.share_servers_across_windows` is enabled.
+        """
+        window = view.window()
+        if not window or not sublime.load_settings('Mir.sublime-settings').get('mir.share_servers_across_windows', False):
+            return None
+        folder_uris = sorted(f['uri'] for f in workspace_folders_for_window(window))
+        expected_hash = None
+        for server in ManageServers.all_servers():
+            if server.name != server_class.name or not server.is_running() or window in server.windows:
+                continue
+            if server.activation_events.get('on_uri'):  # those servers are tied to the views that started them
+                continue
+            if sorted(f['uri'] for f in server.initialize_params.get('workspaceFolders') or []) != folder_uris:
+                continue
+            if expected_hash is None:
+                expected_hash = settings_hash(server_class.settings_for_view(view).get())
+            if server.settings_hash == expected_hash:
+                return server
+        return None
+
     @classmethod
     def attach_server_to_window(cls, server: LanguageServer, window: sublime.Window):
         ManageServers.language_servers_per_window.setdefault(window.id(), [])
         ManageServers.language_servers_per_window[window.id()].append(server)
+        server.windows.append(window)
 
     @classmethod
     def detach_server_from_window(cls, server: LanguageServer, window: sublime.Window):
         ManageServers.language_servers_per_window[window.id()] = [s for s in ManageServers.language_servers_per_window[window.id()] if s != server]
+        server.windows = [w for w in server.windows if w.id() != window.id()]
 
     @classmethod
     def detach_all_servers_from_window(cls, window: sublime.Window):
-        del ManageServers.language_servers_per_window[window.id()]
+        for server in ManageServers.language_servers_per_window.pop(window.id(), []):
+            server.windows = [w for w in server.windows if w.id() != window.id()]
 
     def on_init(self, views: list[sublime.View]):
+        ProcessWatchdog.start()
         sublime_aio.run_coroutine(self.initialize(views))
 
     async def initialize(self, views: list[sublime.View]):
@@ -123,13 +163,19 @@ class ManageServers(sublime_aio.EventListener):
 
     def on_pre_close(self, view):
         close_document(view)
+        Providers.invalidate(view)
+        LineIndexes.invalidate(view)
 
     def on_new_window(self, window):
         mir_logger.info('EventListener on_new_window', window)
 
     def on_pre_close_window(self, window: sublime.Window):
-        for server in ManageServers.servers_for_window(window):
-            server.stop()
-        for folder_name in window.folders():
-            remove_file_watcher(folder_name)
+        servers = ManageServers.servers_for_window(window)
         ManageServers.detach_all_servers_from_window(window)
+        for server in servers:
+            if server.windows:
+                # still used by other windows
+                server.leave_window(window)
+                continue
+            if not WarmPool.park(server, window):
+                server.stop()
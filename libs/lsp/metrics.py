@@ -0,0 +1,65 @@
+from __future__ import annotations
+from collections import deque
+from typing import Any, Deque, Dict
+
+
+MAX_SAMPLES = 50
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency samples.
+    Use the `Mir: Show Metrics` command to see them.
+    """
+    counters: Dict[str, int] = {}
+    gauges: Dict[str, Any] = {}
+    latencies: Dict[str, Deque[float]] = {}
+
+    @staticmethod
+    def increment(name: str, value: int = 1) -> None:
+        Metrics.counters[name] = Metrics.counters.get(name, 0) + value
+
+    @staticmethod
+    def set_gauge(name: str, value: Any) -> None:
+        Metrics.gauges[name] = value
+
+    @staticmethod
+    def remove_gauge(name: str) -> None:
+        Metrics.gauges.pop(name, None)
+
+    @staticmethod
+    def record_latency(name: str, seconds: float) -> None:
+        samples = Metrics.latencies.get(name)
+        if samples is None:
+            samples = deque(maxlen=MAX_SAMPLES)
+            Metrics.latencies[name] = samples
+        samples.append(seconds)
+
+    @staticmethod
+    def percentile(name: str, percent: float) -> float | None:
+        """ Returns the given percentile of the recent latency samples, or None if there are no samples. """
+        samples = Metrics.latencies.get(name)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    @staticmethod
+    def sample_count(name: str) -> int:
+        return len(Metrics.latencies.get(name, ()))
+
+    @staticmethod
+    def format() -> str:
+        lines: list[str] = ['# Counters']
+        lines.extend(f'{name}: {value}' for name, value in sorted(Metrics.counters.items()))
+        lines.append('')
+        lines.append('# Gauges')
+        lines.extend(f'{name}: {value}' for name, value in sorted(Metrics.gauges.items()))
+        lines.append('')
+        lines.append('# Latencies (p50 / p95 / samples)')
+        for name in sorted(Metrics.latencies):
+            p50 = Metrics.percentile(name, 50) or 0
+            p95 = Metrics.percentile(name, 95) or 0
+            lines.append(f'{name}: {p50 * 1000:.0f}ms / {p95 * 1000:.0f}ms / {Metrics.sample_count(name)}')
+        return '\n'.join(lines) + '\n'
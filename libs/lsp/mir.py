@@ -5,207 +5,71 @@ from Mir import mir_logger
 from sublime_aio import overload
 
 from .commands import MirCommand
+from .fan_out import SourceName, fan_out
+from .metrics import Metrics
 import sys
 from .manage_servers import server_for_view, servers_for_view
 from .providers import CodeActionProvider, Providers, HoverProvider, CompletionProvider, DefinitionProvider, DocumentSymbolProvider, ReferencesProvider
-from .server import is_applicable_view
 from Mir.types.lsp import CodeAction, CodeActionContext, Command, Definition, DocumentSymbol, Location, SymbolInformation, LocationLink, Hover, CompletionItem, CompletionList, DocumentUri, Diagnostic
-from .view_to_lsp import get_view_uri, range_to_region
+from .view_to_lsp import get_view_uri, ranges_to_regions
 import sublime
 
-SourceName = str
-""" The language server name or the provider name """
-
-MAX_WAIT_TIME=1 # second is a lot of time
+DIAGNOSTICS_BATCH_WINDOW = 50 # ms
 
 class mir:
     commands = MirCommand
 
     @staticmethod
     async def definitions(view: sublime.View, point: int) -> list[tuple[SourceName, Definition | list[LocationLink] | None]]:
-        # STEP 1:
-        providers = [provider for provider in Providers.definition_providers if provider.is_applicable() and is_applicable_view(view, provider.activation_events)]
-        for provider in providers:
-            await provider.cancel()
-
-        # STEP 2 define return value
-        results: list[tuple[SourceName, Definition | list[LocationLink] | None]] = []
-
-        # STEP 3:
-        async def handle(provider: DefinitionProvider):
-            try:
-                result = await asyncio.wait_for(provider.provide_definition(view, point), MAX_WAIT_TIME)
-            except Exception as e:
-                await provider.cancel()
-                mir_logger.error(f'Error happened in provider {provider.name}', exc_info=e)
-                return (provider.name, None)
-            return (provider.name, result)
-
-        try:
-            results = await asyncio.gather(
-                *[handle(provider) for provider in providers],
-            )
-        except Exception as e:
-            mir_logger.error('Mir (DefinitionError):', exc_info=e)
-        return results
+        providers: list[DefinitionProvider] = Providers.for_view('definition_providers', view)
+        return await fan_out('definitions', providers, lambda provider: provider.provide_definition(view, point))
 
     @staticmethod
     async def references(view: sublime.View, point: int) -> list[tuple[SourceName, list[Location] | None]]:
-        # STEP 1:
-        providers = [provider for provider in Providers.reference_providers if provider.is_applicable() and is_applicable_view(view, provider.activation_events)]
-        for provider in providers:
-            await provider.cancel()
-
-        # STEP 2 define return value
-        results: list[tuple[SourceName, list[Location] | None]] = []
-
-        # STEP 3:
-        async def handle(provider: ReferencesProvider):
-            try:
-                result = await asyncio.wait_for(provider.provide_references(view, point), MAX_WAIT_TIME)
-            except Exception as e:
-                await provider.cancel()
-                mir_logger.error(f'Error happened in provider {provider.name}', exc_info=e)
-                return (provider.name, None)
-            return (provider.name, result)
-
-        try:
-            results = await asyncio.gather(
-                *[handle(provider) for provider in providers],
-            )
-        except Exception as e:
-            mir_logger.error('Mir (ReferenceError):', exc_info=e)
-        return results
+        providers: list[ReferencesProvider] = Providers.for_view('reference_providers', view)
+        return await fan_out('references', providers, lambda provider: provider.provide_references(view, point))
 
     @staticmethod
     async def code_actions(view: sublime.View, region: sublime.Region, context: CodeActionContext) -> list[tuple[SourceName, list[Command | CodeAction] | None]]:
-        # STEP 1:
-        providers = [provider for provider in Providers.code_action_providers if provider.is_applicable() and is_applicable_view(view, provider.activation_events)]
-        for provider in providers:
-            await provider.cancel()
+        providers: list[CodeActionProvider] = Providers.for_view('code_action_providers', view)
 
-        # STEP 2 define return value
-        results: list[tuple[SourceName, list[Command | CodeAction] | None]] = []
-
-        # STEP 3:
-        async def handle(provider: CodeActionProvider):
-            try:
-                diagnostics = await mir.get_diagnostics(view, provider.name)
-                diagnostics_in_region = [d for d in diagnostics if region.intersects(range_to_region(view, d['range']))]
-                context['diagnostics'].extend(diagnostics_in_region)
-                result = await asyncio.wait_for(provider.provide_code_actions(view, region, context), MAX_WAIT_TIME)
-            except Exception as e:
-                await provider.cancel()
-                mir_logger.error(f'Error happened in provider {provider.name}', exc_info=e)
-                return (provider.name, None)
-            return (provider.name, result)
+        async def request(provider: CodeActionProvider):
+            diagnostics = await mir.get_diagnostics(view, provider.name)
+            diagnostic_regions = ranges_to_regions(view, [d['range'] for d in diagnostics])
+            diagnostics_in_region = [d for d, r in zip(diagnostics, diagnostic_regions) if region.intersects(r)]
+            context['diagnostics'].extend(diagnostics_in_region)
+            return await provider.provide_code_actions(view, region, context)
 
-        try:
-            results = await asyncio.gather(
-                *[handle(provider) for provider in providers],
-            )
-        except Exception as e:
-            mir_logger.error('Mir (CodeActionError):', exc_info=e)
-        return results
+        return await fan_out('code_actions', providers, request)
 
     @staticmethod
     async def hover(view: sublime.View, hover_point: int, hover_zone: sublime.HoverZone) -> list[tuple[SourceName, Hover | None]]:
-        # STEP 1:
-        # Trigger Canceling Providers
-        providers = [provider for provider in Providers.hover_providers if provider.is_applicable() and is_applicable_view(view, provider.activation_events)]
-        for provider in providers:
-            await provider.cancel()
-
-        # STEP 2 define return value
-        results: list[tuple[SourceName, Hover | None]] = []
-
-        # STEP 3:
-        async def handle(provider: HoverProvider):
-            try:
-                result = await asyncio.wait_for(provider.provide_hover(view, hover_point, hover_zone), MAX_WAIT_TIME)
-            except Exception as e:
-                await provider.cancel()
-                mir_logger.error(f'Error happened in provider {provider.name}', exc_info=e)
-                return (provider.name, None)
-            return (provider.name, result)
-
-        # STEP 4:
-        # await all futures and handle them appropriately
-        try:
-            results = await asyncio.gather(
-                *[handle(provider) for provider in providers],
-            )
-        except Exception as e:
-            mir_logger.error('Mir (HoverError):', exc_info=e)
-        return results
+        providers: list[HoverProvider] = Providers.for_view('hover_providers', view)
+        return await fan_out('hover', providers, lambda provider: provider.provide_hover(view, hover_point, hover_zone))
 
     cache_completion_response = {}
     @staticmethod
     async def completions(view: sublime.View, prefix: str, locations: list[int]) -> list[tuple[SourceName, list[CompletionItem] | CompletionList | None]]:
-        # STEP 1:
-        # Trigger Canceling Providers
-        providers = [provider for provider in Providers.completion_providers if provider.is_applicable() and is_applicable_view(view, provider.activation_events)]
-        for provider in providers:
-            await provider.cancel()
-
-        # STEP 2 define return value
-        results: list[tuple[SourceName, list[CompletionItem] | CompletionList | None]] = []
-
-        # STEP 3:
-        async def handle(provider: CompletionProvider):
-            try:
-                cache = mir.cache_completion_response.get(provider.name)
-                if cache is not None:
-                    return cache
-                result = await asyncio.wait_for(provider.provide_completion_items(view, prefix, locations), MAX_WAIT_TIME)
-                if sizeof(result) > 1_000_000:
-                    mir.cache_completion_response[provider.name] = result
-                    def reset():
-                        del mir.cache_completion_response[provider.name]
-                    sublime.set_timeout(reset, 6_000) # this prevent lag while typing for 6 seconds
-            except Exception as e:
-                mir_logger.error(f'Error happened in provider {provider.name}', exc_info=e)
-                return (provider.name, None)
-            return (provider.name, result)
+        providers: list[CompletionProvider] = Providers.for_view('completion_providers', view)
+
+        async def request(provider: CompletionProvider):
+            result = await provider.provide_completion_items(view, prefix, locations)
+            if sizeof(result) > 1_000_000:
+                mir.cache_completion_response[provider.name] = result
+                def reset():
+                    del mir.cache_completion_response[provider.name]
+                sublime.set_timeout(reset, 6_000) # this prevent lag while typing for 6 seconds
+            return result
 
-        # STEP 4:
-        # await all futures and handle them appropriately
-        try:
-            results = await asyncio.gather(
-                *[handle(provider) for provider in providers],
-            )
-        except Exception as e:
-            mir_logger.error('Mir (CompletionError):', exc_info=e)
-        return results
+        # cached responses skip `fan_out`, their instant "latency" would shrink the deadline for the real requests
+        cached = [mir.cache_completion_response.get(p.name) for p in providers]
+        results = iter(await fan_out('completions', [p for p, c in zip(providers, cached) if c is None], request))
+        return [(p.name, c) if c is not None else next(results) for p, c in zip(providers, cached)]
 
     @staticmethod
     async def document_symbols(view: sublime.View) -> list[tuple[SourceName, list[SymbolInformation] | list[DocumentSymbol] | None]]:
-        # STEP 1:
-        providers = [provider for provider in Providers.document_symbols_providers if provider.is_applicable() and is_applicable_view(view, provider.activation_events)]
-        for provider in providers:
-            await provider.cancel()
-
-        # STEP 2 define return value
-        results: list[tuple[SourceName, list[SymbolInformation] | list[DocumentSymbol] | None]] = []
-        # STEP 3:
-        async def handle(provider: DocumentSymbolProvider):
-            try:
-                result = await asyncio.wait_for(provider.provide_document_symbol(view), MAX_WAIT_TIME)
-            except Exception as e:
-                await provider.cancel()
-                mir_logger.error(f'Error happened in provider {provider.name}', exc_info=e)
-                return (provider.name, None)
-            return (provider.name, result)
-
-        # STEP 4:
-        # await all futures and handle them appropriately
-        try:
-            results = await asyncio.gather(
-                *[handle(provider) for provider in providers],
-            )
-        except Exception as e:
-            mir_logger.error('Mir (DocumentSymbolError):', exc_info=e)
-        return results
+        providers: list[DocumentSymbolProvider] = Providers.for_view('document_symbols_providers', view)
+        return await fan_out('document_symbols', providers, lambda provider: provider.provide_document_symbol(view))
 
     @overload
     @staticmethod
@@ -247,9 +111,38 @@ class mir:
             mir._on_did_change_diagnostics_cbs = [c for c in mir._on_did_change_diagnostics_cbs if c != cb]
         return cleanup
 
+    # uris with changed diagnostics that listeners were not notified about yet (insertion ordered)
+    _pending_diagnostics_uris: dict[str, None] = {}
+    _flush_diagnostics_scheduled = False
+
     @staticmethod
     def _notify_did_change_diagnostics(uris: list[str]):
-        [cb(uris) for cb in mir._on_did_change_diagnostics_cbs]
+        """
+        Listeners are notified once per batch window with every uri that changed in it,
+        so a project wide check does not call each listener once per file.
+        """
+        for uri in uris:
+            mir._pending_diagnostics_uris[uri] = None
+        if mir._flush_diagnostics_scheduled:
+            return
+        mir._flush_diagnostics_scheduled = True
+        window_ms = sublime.load_settings('Mir.sublime-settings').get('mir.diagnostics_batch_window', DIAGNOSTICS_BATCH_WINDOW)
+        asyncio.get_event_loop().call_later(window_ms / 1000, mir._flush_did_change_diagnostics)
+
+    @staticmethod
+    def _flush_did_change_diagnostics():
+        uris = list(mir._pending_diagnostics_uris)
+        mir._pending_diagnostics_uris = {}
+        mir._flush_diagnostics_scheduled = False
+        if not uris:
+            return
+        Metrics.increment('diagnostics.notifications')
+        Metrics.increment('diagnostics.changed_uris', len(uris))
+        for cb in list(mir._on_did_change_diagnostics_cbs):
+            try:
+                cb(uris)
+            except Exception as e:
+                mir_logger.error('Mir: Error in on_did_change_diagnostics callback', exc_info=e)
 
 def sizeof(obj):
     size = sys.getsizeof(obj)
@@ -0,0 +1,126 @@
+from __future__ import annotations
+from Mir import mir_logger
+from .metrics import Metrics
+from typing import Dict, Tuple
+import asyncio
+import os
+import sublime
+import sublime_aio
+import time
+
+
+PROCESS_WATCHDOG_INTERVAL = 10
+""" Seconds between samples. Overridden by the `mir.process_watchdog_interval` setting. """
+CPU_LIMIT_SAMPLES = 3
+""" The CPU limit must be exceeded for this many samples in a row, a single busy sample (like indexing) is fine. """
+
+
+def read_process_tree(pid: int) -> tuple[int, float] | None:
+    """
+    Returns the resident memory in bytes and the CPU time in seconds of a process and its descendants.
+    Only works on Linux, returns None if `/proc` is not available or the process is gone.
+    """
+    try:
+        rss, cpu = read_process(pid)
+    except (OSError, ValueError, IndexError):
+        return None
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        children = []
+    for child in children:
+        child_usage = read_process_tree(child)
+        if child_usage:
+            rss += child_usage[0]
+            cpu += child_usage[1]
+    return rss, cpu
+
+
+def read_process(pid: int) -> tuple[int, float]:
+    with open(f'/proc/{pid}/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    with open(f'/proc/{pid}/stat') as f:
+        # the process name can contain spaces, the fields after it can not
+        fields = f.read().rsplit(')', 1)[1].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return rss, (utime + stime) / os.sysconf('SC_CLK_TCK')
+
+
+class ProcessWatchdog:
+    """
+    Samples the memory and CPU usage of the language server processes, see `Mir: Show Metrics`.
+    A server that goes over `mir.server_memory_limit_mb` or `mir.server_cpu_limit_percent` is restarted.
+    """
+    _task: asyncio.Future | None = None
+    # pid -> (CPU time in seconds, time of the sample)
+    _cpu_samples: Dict[int, Tuple[float, float]] = {}
+    # pid -> number of samples in a row that were over the CPU limit
+    _cpu_over_limit: Dict[int, int] = {}
+    _gauges: list[str] = []
+
+    @staticmethod
+    def start():
+        if not os.path.exists('/proc/self/statm'):
+            return
+        if ProcessWatchdog._task and not ProcessWatchdog._task.done():
+            return
+        ProcessWatchdog._task = sublime_aio.run_coroutine(ProcessWatchdog._run_forever())
+
+    @staticmethod
+    async def _run_forever():
+        while True:
+            interval = sublime.load_settings('Mir.sublime-settings').get('mir.process_watchdog_interval', PROCESS_WATCHDOG_INTERVAL)
+            await asyncio.sleep(interval)
+            try:
+                ProcessWatchdog.sample()
+            except Exception as e:
+                mir_logger.error('Mir: Error in the process watchdog.', exc_info=e)
+
+    @staticmethod
+    def sample():
+        from .manage_servers import ManageServers
+        settings = sublime.load_settings('Mir.sublime-settings')
+        memory_limit_mb: float = settings.get('mir.server_memory_limit_mb', 0)
+        cpu_limit_percent: float = settings.get('mir.server_cpu_limit_percent', 0)
+        gauges: list[str] = []
+        pids: list[int] = []
+        for server in ManageServers.all_servers():
+            process = server._process
+            if not process or process.returncode is not None:
+                continue
+            usage = read_process_tree(process.pid)
+            if usage is None:
+                continue
+            rss, cpu_time = usage
+            now = time.monotonic()
+            pids.append(process.pid)
+            rss_mb = rss / (1024 * 1024)
+            cpu_percent = None
+            previous = ProcessWatchdog._cpu_samples.get(process.pid)
+            ProcessWatchdog._cpu_samples[process.pid] = (cpu_time, now)
+            if previous and now > previous[1]:
+                cpu_percent = (cpu_time - previous[0]) / (now - previous[1]) * 100
+            key = f'process.{server.name}.{process.pid}'
+            Metrics.set_gauge(f'{key}.rss_mb', round(rss_mb))
+            gauges.append(f'{key}.rss_mb')
+            if cpu_percent is not None:
+                Metrics.set_gauge(f'{key}.cpu_percent', round(cpu_percent))
+                gauges.append(f'{key}.cpu_percent')
+
+            if cpu_limit_percent and cpu_percent is not None and cpu_percent > cpu_limit_percent:
+                ProcessWatchdog._cpu_over_limit[process.pid] = ProcessWatchdog._cpu_over_limit.get(process.pid, 0) + 1
+            else:
+                ProcessWatchdog._cpu_over_limit.pop(process.pid, None)
+
+            if memory_limit_mb and rss_mb > memory_limit_mb:
+                sublime_aio.run_coroutine(server.restart(f'using {rss_mb:.0f}MB of memory (limit {memory_limit_mb}MB)'))
+            elif ProcessWatchdog._cpu_over_limit.get(process.pid, 0) >= CPU_LIMIT_SAMPLES:
+                sublime_aio.run_coroutine(server.restart(f'using {cpu_percent:.0f}% CPU (limit {cpu_limit_percent}%)'))
+
+        for name in ProcessWatchdog._gauges:
+            if name not in gauges:
+                Metrics.remove_gauge(name)
+        ProcessWatchdog._gauges = gauges
+        ProcessWatchdog._cpu_samples = {pid: s for pid, s in ProcessWatchdog._cpu_samples.items() if pid in pids}
+        ProcessWatchdog._cpu_over_limit = {pid: c for pid, c in ProcessWatchdog._cpu_over_limit.items() if pid in pids}
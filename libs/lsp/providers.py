@@ -1,8 +1,9 @@
 from __future__ import annotations
-from typing import List, Union
+from typing import Dict, List, Literal, Tuple, Union
 
 from sublime_plugin import importlib
-from .server import ActivationEvents
+from .server import ActivationEvents, ActivationMatcher
+from .view_to_lsp import get_view_uri
 from Mir.types.lsp import CodeActionContext, CompletionItem, Hover, CompletionList, Definition, Location, LocationLink, SymbolInformation, DocumentSymbol, Command, CodeAction
 import sublime
 
@@ -49,6 +50,8 @@ class BaseProvider:
         else:
             run()
 
+ProvidersKey = Literal['definition_providers', 'reference_providers', 'code_action_providers', 'hover_providers', 'completion_providers', 'document_symbols_providers']
+
 class Providers:
     definition_providers: List[DefinitionProvider]=[]
     reference_providers: List[ReferencesProvider]=[]
@@ -57,6 +60,34 @@ class Providers:
     completion_providers: List[CompletionProvider]=[]
     document_symbols_providers: List[DocumentSymbolProvider]=[]
 
+    # id(provider) -> activation matcher compiled in `register_provider`
+    _matchers: Dict[int, ActivationMatcher] = {}
+    # view.id() -> ((syntax, uri), providers_key -> providers that match the view)
+    _applicable: Dict[int, Tuple[Tuple[str, str], Dict[str, list]]] = {}
+
+    @classmethod
+    def for_view(cls, providers_key: ProvidersKey, view: sublime.View) -> list:
+        """ Providers of the given kind that are applicable for the view. """
+        syntax = view.syntax()
+        cache_key = (syntax.path if syntax else '', get_view_uri(view))
+        cached = cls._applicable.get(view.id())
+        if cached is None or cached[0] != cache_key:
+            cached = (cache_key, {})
+            cls._applicable[view.id()] = cached
+        providers = cached[1].get(providers_key)
+        if providers is None:
+            uri = cache_key[1]
+            providers = [p for p in getattr(cls, providers_key) if cls._matchers[id(p)].matches(view, uri)]
+            cached[1][providers_key] = providers
+        return [p for p in providers if p.is_applicable()]
+
+    @classmethod
+    def invalidate(cls, view: sublime.View | None = None) -> None:
+        if view is None:
+            cls._applicable.clear()
+            return
+        cls._applicable.pop(view.id(), None)
+
 
 class DefinitionProvider(BaseProvider):
     name: str
@@ -110,6 +141,8 @@ class DocumentSymbolProvider(BaseProvider):
 
 AllProviders = Union[DefinitionProvider, ReferencesProvider, CodeActionProvider, HoverProvider, CompletionProvider, DocumentSymbolProvider]
 def register_provider(provider: AllProviders):
+    Providers._matchers[id(provider)] = ActivationMatcher(provider.activation_events)
+    Providers.invalidate()
     if isinstance(provider, DefinitionProvider):
         Providers.definition_providers.append(provider)
     elif isinstance(provider, ReferencesProvider):
@@ -127,6 +160,7 @@ def register_provider(provider: AllProviders):
 
 
 def unregister_provider(provider: AllProviders):
+    Providers.invalidate()
     if isinstance(provider, DefinitionProvider):
         Providers.definition_providers = [p for p in Providers.definition_providers if p != provider]
     elif isinstance(provider, ReferencesProvider):
@@ -141,4 +175,5 @@ def unregister_provider(provider: AllProviders):
         Providers.document_symbols_providers = [p for p in Providers.document_symbols_providers if p != provider]
     else:
         raise Exception(f'Mir: Got a unusported provider {provider.name} during unregister_provider')
+    Providers._matchers.pop(id(provider), None)
 
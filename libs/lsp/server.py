@@ -10,28 +10,69 @@ from .capabilities import CLIENT_CAPABILITIES, ServerCapabilities
 from .lsp_requests import LspRequest, LspNotification, Request
 from Mir.types.lsp import DidChangeTextDocumentParams, ErrorCodes, InitializeParams, LSPAny, MessageType, WorkspaceFolder
 from .console import Console, format_payload
-from .view_to_lsp import file_name_to_uri, get_view_uri
+from .view_to_lsp import file_name_to_uri, get_view_uri, view_to_text_document_item
 from pathlib import Path
 from sublime_plugin import sublime
 from typing import Any, Callable, Dict, Literal, Optional, TypedDict, cast
 from typing_extensions import NotRequired
 from wcmatch.glob import BRACE
 from .dotted_dict import DottedDict
-from wcmatch.glob import globmatch
+from wcmatch.glob import globmatch, translate
 from wcmatch.glob import GLOBSTAR
 import asyncio
 import sublime_aio
 import datetime
 import orjson
 from .diagnostic_collection import DiagnosticCollection
+from .file_watcher import FileWatchers
+from .metrics import Metrics
+from .inbound_queue import BACKGROUND_METHODS, INTERACTIVE_METHODS, InboundQueue, Priority
 import importlib
 import functools
+import hashlib
+import time
 import sublime_aio
 import asyncio
 
 
 ENCODING = "utf-8"
 
+REQUEST_TIMEOUT = 30
+""" Seconds after which a request without a response is abandoned, see `request_timeouts`. """
+request_timeouts: dict[str, float] = {
+    'shutdown': 5,
+    # requests whose results can be dropped, user started operations (like rename, formatting or execute command) wait as long as they take
+    'textDocument/hover': REQUEST_TIMEOUT,
+    'textDocument/completion': REQUEST_TIMEOUT,
+    'completionItem/resolve': REQUEST_TIMEOUT,
+    'textDocument/codeAction': REQUEST_TIMEOUT,
+    'codeAction/resolve': REQUEST_TIMEOUT,
+    'textDocument/definition': REQUEST_TIMEOUT,
+    'textDocument/documentSymbol': REQUEST_TIMEOUT,
+    'textDocument/diagnostic': REQUEST_TIMEOUT,
+    'textDocument/prepareRename': REQUEST_TIMEOUT,
+    'textDocument/signatureHelp': REQUEST_TIMEOUT,
+    'textDocument/documentHighlight': REQUEST_TIMEOUT,
+    'textDocument/inlayHint': REQUEST_TIMEOUT,
+}
+
+MAX_CANCELLED_REQUEST_IDS = 1000
+
+CRASH_BACKOFF = 1
+""" Seconds to wait before restarting a crashed server, doubled for every crash in `CRASH_WINDOW`. """
+MAX_CRASH_BACKOFF = 30
+MAX_CRASHES = 5
+""" A server that crashes more than this many times in `CRASH_WINDOW` seconds is not restarted. """
+CRASH_WINDOW = 180
+RESTART_QUEUE_TIMEOUT = 10
+""" Requests sent while the server restarts are sent after the restart, or fail after this many seconds. """
+
+HIGH_VOLUME_NOTIFICATIONS = {'$/progress', '$/logTrace', 'telemetry/event'}
+""" Notifications that are dropped without logging when no handler is registered for them. """
+
+OFF_LOOP_DECODE_MIN_BYTES = 1_000_000
+""" Bodies of at least this many bytes are decoded in a worker thread. Overridden by the `mir.off_loop_decode_min_bytes` setting. """
+
 
 class Error(Exception):
     def __init__(self, code: ErrorCodes, message: str) -> None:
@@ -92,6 +133,68 @@ def content_length(line: bytes) -> Optional[int]:
     return None
 
 
+_OBJECT_START = re.compile(rb'\s*\{')
+_KEY = re.compile(rb'\s*"([^"\\]*)"\s*:\s*')
+_SCALAR = re.compile(rb'(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|"[^"\\]*"|true|false|null)\s*,?')
+MAX_PEEK_KEYS = 8
+
+
+def peek_response_id(body: bytes) -> int | str | None:
+    """
+    Returns the `id` of a response without parsing the whole body.
+    Only the top level keys before `result` or `error` are scanned,
+    so None is returned if the body is not a response, or if the `id` comes after the result.
+    """
+    match = _OBJECT_START.match(body)
+    if not match:
+        return None
+    pos = match.end()
+    request_id: int | str | None = None
+    for _ in range(MAX_PEEK_KEYS):
+        key_match = _KEY.match(body, pos)
+        if not key_match:
+            return None
+        key = key_match.group(1)
+        if key in (b'result', b'error'):
+            return request_id
+        if key == b'method':
+            return None
+        value_match = _SCALAR.match(body, key_match.end())
+        if not value_match:
+            return None
+        if key == b'id':
+            value = value_match.group(1)
+            if value.startswith(b'"'):
+                request_id = value[1:-1].decode(ENCODING)
+            else:
+                try:
+                    request_id = int(value)
+                except ValueError:
+                    return None
+        pos = value_match.end()
+    return None
+
+
+def peek_method(body: bytes) -> str | None:
+    """ Returns the `method` of a request or notification if it is one of the first top level keys. """
+    match = _OBJECT_START.match(body)
+    if not match:
+        return None
+    pos = match.end()
+    for _ in range(MAX_PEEK_KEYS):
+        key_match = _KEY.match(body, pos)
+        if not key_match:
+            return None
+        value_match = _SCALAR.match(body, key_match.end())
+        if not value_match:
+            return None
+        if key_match.group(1) == b'method':
+            value = value_match.group(1)
+            return value[1:-1].decode(ENCODING) if value.startswith(b'"') else None
+        pos = value_match.end()
+    return None
+
+
 class ActivationEvents(TypedDict):
     selector: str | Literal['*']
     on_uri: NotRequired[list[str]]
@@ -128,9 +231,28 @@ def matches_activation_event_on_uri(view: sublime.View, activation_events: Activ
     return False
 
 
-class NotificationHandler(TypedDict):
-    method: str
-    cb: Callable[[dict|None],None]
+class ActivationMatcher:
+    """
+    `ActivationEvents` compiled once, so matching a view does not
+    go through `globmatch` for every `on_uri` pattern on every call.
+    """
+    def __init__(self, activation_events: ActivationEvents) -> None:
+        self.selector = activation_events['selector']
+        # one entry per `on_uri` pattern, a BRACE pattern can expand to several regexes
+        self.uri_patterns: list[list[re.Pattern]] = []
+        for uri_pattern in activation_events.get('on_uri') or []:
+            include, _ = translate(uri_pattern, flags=GLOBSTAR | BRACE)
+            self.uri_patterns.append([re.compile(regex) for regex in include])
+
+    def matches(self, view: sublime.View, uri: str | None = None) -> bool:
+        if self.selector == '*':
+            return True
+        if not view.match_selector(0, self.selector):
+            return False
+        if self.uri_patterns:
+            uri = uri if uri is not None else get_view_uri(view)
+            return all(any(regex.match(uri) for regex in regexes) for regexes in self.uri_patterns)
+        return True
 
 
 def register_language_server(server: LanguageServer):
@@ -147,10 +269,21 @@ def register_language_server(server: LanguageServer):
 
 def unregister_language_server(server: LanguageServer):
     from .manage_servers import ManageServers
-    [s.stop() for servers in ManageServers.language_servers_per_window.values() for s in servers if s.name == server.name]
+    from .warm_pool import WarmPool
+    WarmPool.remove(server.name)
+    [s.stop() for s in ManageServers.all_servers() if s.name == server.name]
     ManageServers.language_servers_plugins = [s for s in ManageServers.language_servers_plugins if s.name != server.name]
 
 
+def settings_hash(settings: dict) -> str:
+    """ A stable hash of the language server settings. A running server can only be reused for the same hash. """
+    return hashlib.sha1(orjson.dumps(settings, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def workspace_folders_for_window(window: sublime.Window) -> list[WorkspaceFolder]:
+    return [{'name': Path(f).name, 'uri': file_name_to_uri(f)} for f in window.folders()]
+
+
 server_callbacks_when_ready = []
 
 class LanguageServerConnectionOptions(TypedDict):
@@ -236,6 +369,7 @@ class LanguageServer:
 
         self.register_providers()
         self.notify.initialized({})
+        self._initialized = True
 
     def __init__(self) -> None:
 
@@ -246,6 +380,8 @@ class LanguageServer:
         self.view: sublime.View = sublime.View(-1)
         self.open_views: list[sublime.View] = []
         self.window: sublime.Window = sublime.Window(-1)
+        # every window that uses this server, see `mir.share_servers_across_windows`
+        self.windows: list[sublime.Window] = []
 
         default_setting = sublime.load_settings(self.settings_file).to_dict() if hasattr(self, 'settings_file') else None
         self.settings = DottedDict(default_setting)
@@ -256,6 +392,14 @@ class LanguageServer:
 
         self._process = None
         self._received_shutdown = False
+        self._restarting = False
+        self._initialized = False
+        self._stopped = False
+        # times of the recent crashes, see `CRASH_WINDOW`
+        self._crash_times: list[float] = []
+        # requests sent while restarting, by id
+        self._queued_requests: Dict[Any, Request] = {}
+        self.settings_hash = settings_hash(self.settings.get())
 
         self.initialize_params: InitializeParams = {
             'processId': None,
@@ -271,28 +415,38 @@ class LanguageServer:
         self.request_id = 1
         # requests sent from client
         self._response_handlers: Dict[Any, Request] = {}
+        # ids of abandoned requests, so their late responses can be dropped (insertion ordered, oldest first)
+        self._cancelled_request_ids: Dict[Any, None] = {}
         # requests and notifications sent from server
         self.on_request_handlers = {}
-        self.on_notification_handlers: list[NotificationHandler] = []
+        self.on_notification_handlers: dict[str, list[Callable[[Any], None]]] = {}
         # logs
         self.console: Console = Console(self.name)
         self.before_shutdown: list[Callable[[],None]] = []
 
         self.diagnostics_previous_result_id: str | None = None
+        # decoded (or decoding) bodies, by priority and in the order they were read
+        self._inbound = InboundQueue()
+        self.off_loop_decode_min_bytes = OFF_LOOP_DECODE_MIN_BYTES
         attach_server_request_and_notification_handlers(self)
 
+    @classmethod
+    def settings_for_view(cls, view: sublime.View) -> DottedDict:
+        """ The settings a server started from this view would have. """
+        default_setting = sublime.load_settings(cls.settings_file).to_dict() if hasattr(cls, 'settings_file') else None
+        settings = DottedDict(default_setting)
+        settings.update(view.settings().get('mir.language_server_settings', {}))
+        return settings
+
     async def start(self, view: sublime.View):
-        self.view = view
         self.settings.update(view.settings().get('mir.language_server_settings', {}))
-        window = view.window()
-        if window is None:
-            raise Exception('A window must exists now')
-        self.window = window
-        self.console = Console(self.name, window)
+        self.settings_hash = settings_hash(self.settings.get())
+        self.off_loop_decode_min_bytes = sublime.load_settings('Mir.sublime-settings').get('mir.off_loop_decode_min_bytes', OFF_LOOP_DECODE_MIN_BYTES)
+        self._attach_to_view(view)
 
-        folders = window.folders() if window else []
+        folders = self.window.folders()
         first_folder = folders[0] if folders else ''
-        workspace_folders: list[WorkspaceFolder] = [{'name': Path(f).name, 'uri':file_name_to_uri(f)} for f in folders]
+        workspace_folders = workspace_folders_for_window(self.window)
         first_folder_uri = workspace_folders[0]['uri'] if workspace_folders else None
 
         self.initialize_params = {
@@ -305,15 +459,126 @@ class LanguageServer:
         }
         await self.activate() # lots of stuff can fail here
 
+        self._listen_to_settings()
+        self.notify.workspace_did_change_configuration({'settings': self.settings.get()}) # https://github.com/microsoft/language-server-protocol/issues/567#issuecomment-420589320
+
+    def _attach_to_view(self, view: sublime.View):
+        window = view.window()
+        if window is None:
+            raise Exception('A window must exists now')
+        self.view = view
+        self.window = window
+        self.console = Console(self.name, window)
+
+    def _listen_to_settings(self):
+        view = self.view
+
         def update_settings_on_change():
             self.settings.update(view.settings().get('mir.language_server_settings', {}))
             self.notify.workspace_did_change_configuration({'settings': self.settings.get()}) # https://github.com/microsoft/language-server-protocol/issues/567#issuecomment-420589320
 
-        self.view.settings().add_on_change('mir-settings-listener', update_settings_on_change)
-        self.notify.workspace_did_change_configuration({'settings': self.settings.get()}) # https://github.com/microsoft/language-server-protocol/issues/567#issuecomment-420589320
+        view.settings().add_on_change('mir-settings-listener', update_settings_on_change)
+
+    def supports_workspace_folder_changes(self) -> bool:
+        workspace_folders = self.capabilities.get('workspace.workspaceFolders')
+        return isinstance(workspace_folders, dict) and bool(workspace_folders.get('changeNotifications'))
+
+    def detach(self):
+        """
+        Detaches a running server from its window, without stopping the process.
+        Used by the `WarmPool`, see `reattach`.
+        """
+        self.view.settings().clear_on_change('mir-settings-listener')
+        for view in self.open_views:
+            self.notify.did_close_text_document({
+                'textDocument': {
+                    'uri': get_view_uri(view)
+                }
+            })
+        self.open_views = []
+        self.pending_changes = {}
+        self.view = sublime.View(-1)
+        self.window = sublime.Window(-1)
+        self.console = Console(self.name)
 
+    def open_view(self, view: sublime.View):
+        """ The same document can be open in several views (and windows), the server only knows it once. """
+        if view in self.open_views:
+            return
+        text_document = view_to_text_document_item(view)
+        is_open = any(get_view_uri(v) == text_document['uri'] for v in self.open_views)
+        self.open_views.append(view)
+        if is_open:
+            return
+        self.notify.did_open_text_document({
+            'textDocument': text_document
+        })
+        sublime_aio.run_coroutine(pull_diagnostics(self, text_document['uri']))
+
+    def close_view(self, view: sublime.View):
+        uri = get_view_uri(view)
+        self.open_views = [v for v in self.open_views if v.id() != view.id()]
+        if not any(get_view_uri(v) == uri for v in self.open_views):
+            self.notify.did_close_text_document({
+                'textDocument': {
+                    'uri': uri
+                }
+            })
+
+    def leave_window(self, window: sublime.Window):
+        """ Closes the documents of a window when the server is still used by other windows. """
+        view_ids = [v.id() for v in window.views()]
+        closed_views = [v for v in self.open_views if v.id() in view_ids]
+        self.open_views = [v for v in self.open_views if v.id() not in view_ids]
+        open_uris = [get_view_uri(v) for v in self.open_views]
+        for uri in dict.fromkeys(get_view_uri(v) for v in closed_views):
+            if uri not in open_uris:
+                self.notify.did_close_text_document({
+                    'textDocument': {
+                        'uri': uri
+                    }
+                })
+        if self.window.id() != window.id() or not self.windows:
+            return
+        # the console and the settings move to another window
+        self.view.settings().clear_on_change('mir-settings-listener')
+        new_window = self.windows[0]
+        view = next(iter([v for v in self.open_views if v.window() == new_window]), None) or new_window.active_view()
+        if view:
+            self._attach_to_view(view)
+            self._listen_to_settings()
+
+    def reattach(self, view: sublime.View):
+        """ Attaches a detached server to the window of the view, the workspace folders are updated with `workspace/didChangeWorkspaceFolders`. """
+        self._attach_to_view(view)
+        old_folders = self.initialize_params.get('workspaceFolders') or []
+        new_folders = workspace_folders_for_window(self.window)
+        old_uris = [f['uri'] for f in old_folders]
+        new_uris = [f['uri'] for f in new_folders]
+        added = [f for f in new_folders if f['uri'] not in old_uris]
+        removed = [f for f in old_folders if f['uri'] not in new_uris]
+        if added or removed:
+            self.notify.did_change_workspace_folders({
+                'event': {
+                    'added': added,
+                    'removed': removed
+                }
+            })
+        folders = self.window.folders()
+        self.initialize_params['workspaceFolders'] = new_folders
+        self.initialize_params['rootUri'] = new_folders[0]['uri'] if new_folders else None
+        self.initialize_params['rootPath'] = folders[0] if folders else ''
+        if added or removed:
+            # the watched files registrations were made for the old folders
+            FileWatchers.change_folders(id(self), folders)
+        self._listen_to_settings()
+
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.returncode is None
 
     def stop(self):
+        self._stopped = True
+        self._fail_queued_requests(f'{self.name} was stopped.')
         self.view.settings().clear_on_change('mir-settings-listener')
         sublime_aio.run_coroutine(self.shutdown())
 
@@ -333,7 +598,10 @@ class LanguageServer:
         for cb in self.before_shutdown:
             cb()
         self.cancel_all_requests('Cancelling requests due to shutting down.')
-        await self.send.shutdown().result
+        try:
+            await self.send.shutdown().result
+        except Exception as e:
+            mir_logger.error(f'Mir ({self.name}) Error while shutting down.', exc_info=e)
         self._received_shutdown = True
         self.notify.exit()
         if self._process and self._process.stdout:
@@ -348,9 +616,13 @@ class LanguageServer:
                      {"type": MessageType.Info, "message": message})
 
     async def _run_forever(self) -> bool:
+        process = self._process
+        # a restart replaces `self._inbound`, this process keeps its own queue and dispatcher
+        inbound = self._inbound
+        dispatcher = asyncio.ensure_future(self._dispatch_forever(inbound))
         try:
-            while self._process and self._process.stdout and not self._process.stdout.at_eof():
-                line = await self._process.stdout.readline()
+            while process and process.stdout and not process.stdout.at_eof():
+                line = await process.stdout.readline()
                 if not line:
                     continue
                 try:
@@ -360,11 +632,13 @@ class LanguageServer:
                 if num_bytes is None:
                     continue
                 while line and line.strip():
-                    line = await self._process.stdout.readline()
+                    line = await process.stdout.readline()
                 if not line:
                     continue
-                body = await self._process.stdout.readexactly(num_bytes)
-                await self._handle_body(body, num_bytes)
+                body = await process.stdout.readexactly(num_bytes)
+                self._handle_body(inbound, body, num_bytes)
+            inbound.close()
+            await dispatcher
             self.cancel_all_requests('The process exited so stopping all requests.')
         except (BrokenPipeError, ConnectionResetError) as e:
             mir_logger.error(f'Mir ({self.name}). BrokenPipeError, ConnectionResetError', exc_info=e)
@@ -372,19 +646,173 @@ class LanguageServer:
         except StopLoopException as e:
             mir_logger.error(f'Mir: ({self.name}) stopped.', exc_info=e)
             pass
+        finally:
+            if not dispatcher.done():
+                inbound.close()
+        if process and self._process is process and not self._received_shutdown:
+            await self._on_crash(await process.wait())
         return self._received_shutdown
 
-    async def _handle_body(self, body: bytes, num_bytes: int) -> None:
+    async def _on_crash(self, returncode: int | None):
+        """ Called when the process exits without being shut down. """
+        self.cancel_all_requests('The process exited so stopping all requests.')
+        self._process = None
+        self._initialized = False
+        Metrics.increment(f'process.{self.name}.crashes')
+        mir_logger.error(f'Mir ({self.name}) exited with code {returncode}.')
+        self.console.log(f'Process exited with code {returncode}.')
+        if not self.windows or self._stopped:
+            return
+        if self._restarting:
+            # the process of a restart exited, `restart` counts it and tries again
+            return
+        delay = self._count_crash()
+        if delay is not None:
+            await self.restart(f'exited with code {returncode}', delay)
+
+    def _count_crash(self) -> float | None:
+        """ Returns the delay before the next restart, or None if the server crashed too often and gave up. """
+        now = time.monotonic()
+        self._crash_times = [t for t in self._crash_times if now - t < CRASH_WINDOW] + [now]
+        crashes = len(self._crash_times)
+        if crashes > MAX_CRASHES:
+            sublime.status_message(f'Mir: {self.name} crashed {crashes} times in {CRASH_WINDOW}s and will not be restarted.')
+            self._give_up()
+            return None
+        return min(CRASH_BACKOFF * 2 ** (crashes - 1), MAX_CRASH_BACKOFF)
+
+    def _give_up(self):
+        """ Detaches the dead server, so the next opened document starts a new one. """
+        from .manage_servers import ManageServers
+        self._stopped = True
+        self._fail_queued_requests(f'{self.name} crashed and will not be restarted.')
+        self.view.settings().clear_on_change('mir-settings-listener')
+        before_shutdown, self.before_shutdown = self.before_shutdown, []
+        for cb in before_shutdown:
+            cb()
+        for window in list(self.windows):
+            ManageServers.detach_server_from_window(self, window)
+
+    async def restart(self, reason: str, delay: float = 0):
+        """
+        Replaces the process with a new one. The server is initialized again,
+        the providers are registered again, and the open documents are opened again at their current version.
+        Requests sent in the meantime are queued, see `RESTART_QUEUE_TIMEOUT`.
+        """
+        if self._restarting or self._stopped:
+            return
+        self._restarting = True
+        started = False
+        try:
+            mir_logger.info(f'Mir ({self.name}) restarting in {delay}s, {reason}.')
+            Metrics.increment(f'process.{self.name}.restarts')
+            sublime.status_message(f'Mir: restarting {self.name}, {reason}.')
+            if delay:
+                await asyncio.sleep(delay)
+            if self._stopped:
+                return
+            self._initialized = False
+            views = [v for v in self.open_views if v.is_valid()]
+            self.view.settings().clear_on_change('mir-settings-listener')
+            # the old providers stay registered until the new ones are, their requests are queued meanwhile
+            before_shutdown, self.before_shutdown = self.before_shutdown, []
+            if self.is_running():
+                await self.shutdown()
+            self._process = None
+            self._received_shutdown = False
+            self.capabilities = ServerCapabilities()
+            uris = [uri for uri, _ in self.diagnostics]
+            self.diagnostics.clear()
+            if uris:
+                from .mir import mir
+                mir._notify_did_change_diagnostics(uris)
+            self.diagnostics_previous_result_id = None
+            self.pending_changes = {}
+            self.open_views = []
+            self._inbound = InboundQueue()
+            view = self.view if self.view.is_valid() else next(iter(views), None)
+            if view is None:
+                for cb in before_shutdown:
+                    cb()
+                self._give_up()
+                return
+            try:
+                await self.start(view)
+            finally:
+                for cb in before_shutdown:
+                    cb()
+            for view in views:
+                self.open_view(view)
+            started = True
+        except Exception as e:
+            mir_logger.error(f'Mir ({self.name}) Error while restarting.', exc_info=e)
+        finally:
+            self._restarting = False
+        if self._stopped:
+            self._fail_queued_requests(f'{self.name} could not be restarted.')
+            return
+        if started and self._initialized and self.is_running():
+            self._send_queued_requests()
+            return
+        # the new process did not start, or exited while starting, the queued requests wait for the next attempt
+        delay = self._count_crash()
+        if delay is not None:
+            await self.restart('it could not be restarted', delay)
+
+    async def _dispatch_forever(self, inbound: InboundQueue) -> None:
+        """
+        Handles the decoded payloads, see `InboundQueue` for the order.
+        Yields to the event loop after every batch, so a storm of notifications can not starve the UI.
+        """
+        while True:
+            batch = await inbound.next_batch()
+            if batch is None:
+                return
+            for decoded in batch:
+                try:
+                    await self._receive_payload(await decoded)
+                except IOError as ex:
+                    self._log(f"Mir ({self.name})  malformed {ENCODING}: {ex}")
+                except UnicodeDecodeError as ex:
+                    self._log(f"Mir ({self.name})  malformed {ENCODING}: {ex}")
+                except orjson.JSONDecodeError as ex:
+                    self._log(f"Mir ({self.name})  malformed JSON: {ex}")
+                except Exception as e:
+                    mir_logger.error(f"Mir ({self.name}) Error in _dispatch_forever. ", exc_info=e)
+            await asyncio.sleep(0)
+
+    def _decode(self, body: bytes, num_bytes: int) -> asyncio.Future:
+        """ Small bodies are decoded inline, large ones in a worker thread so other servers are not blocked. """
+        loop = asyncio.get_event_loop()
+        if num_bytes >= self.off_loop_decode_min_bytes:
+            Metrics.increment('responses.decoded_off_loop')
+            return loop.run_in_executor(None, orjson.loads, body)
+        decoded = loop.create_future()
         try:
-            await self._receive_payload(orjson.loads(body))
-        except IOError as ex:
-            self._log(f"Mir ({self.name})  malformed {ENCODING}: {ex}")
-        except UnicodeDecodeError as ex:
-            self._log(f"Mir ({self.name})  malformed {ENCODING}: {ex}")
-        except orjson.JSONDecodeError as ex:
-            self._log(f"Mir ({self.name})  malformed JSON: {ex}")
+            decoded.set_result(orjson.loads(body))
         except Exception as e:
-            mir_logger.error(f"Mir ({self.name}) Error in _handle_body. ", exc_info=e)
+            decoded.set_exception(e)
+        return decoded
+
+    def _handle_body(self, inbound: InboundQueue, body: bytes, num_bytes: int) -> None:
+        request_id = peek_response_id(body)
+        if request_id is not None and request_id not in self._response_handlers:
+            # nobody waits for this response (cancelled or unknown request), skip parsing it
+            self._cancelled_request_ids.pop(request_id, None)
+            Metrics.increment('responses.skipped')
+            Metrics.increment('responses.skipped_bytes', num_bytes)
+            self.console.log(f'Skipped response ({request_id}) - {num_bytes} bytes, nobody waits for it')
+            return
+        if request_id is not None:
+            priority = Priority.Interactive if self._response_handlers[request_id].method in INTERACTIVE_METHODS else Priority.Normal
+        else:
+            method = peek_method(body)
+            if method in HIGH_VOLUME_NOTIFICATIONS and not self.on_notification_handlers.get(method):
+                # nobody listens to it, skip parsing it
+                Metrics.increment('notifications.dropped')
+                return
+            priority = Priority.Background if method in BACKGROUND_METHODS else Priority.Normal
+        inbound.put(priority, self._decode(body, num_bytes))
 
     async def _receive_payload(self, payload: dict) -> None:
         try:
@@ -421,16 +849,58 @@ class LanguageServer:
         self.send_did_change_text_document()
         request_id = self.request_id
         self.request_id += 1
-        response = Request(self, request_id, method, params)
+        response = Request(self, request_id, method, params, timeout=request_timeouts.get(method))
+        if self._restarting and not self._initialized and method not in ('initialize', 'shutdown'):
+            self._queued_requests[request_id] = response
+            asyncio.get_event_loop().call_later(RESTART_QUEUE_TIMEOUT, self._expire_queued_request, request_id)
+            self.console.log(f'Queued request "{method}" ({request_id}) until the server restarts')
+            return response
         self._response_handlers[request_id] = response
         self.console.log(f'Sending request "{method}" ({request_id})\nParams: {format_payload(params)}')
         sublime_aio.run_coroutine(self._send_payload(make_request(method, request_id, params)))
         return response
 
     def cancel_all_requests(self, message: str):
-        for request_id in self._response_handlers:
-            response = self._response_handlers[request_id]
-            response.result.set_exception(Exception(message))
+        requests = list(self._response_handlers.values())
+        self._response_handlers.clear()
+        for request in requests:
+            if not request.result.done():
+                request.result.set_exception(Exception(message))
+
+    def _send_queued_requests(self):
+        requests = list(self._queued_requests.values())
+        self._queued_requests = {}
+        for request in requests:
+            if request.result.done():
+                continue
+            self._response_handlers[request.id] = request
+            self.console.log(f'Sending queued request "{request.method}" ({request.id})')
+            sublime_aio.run_coroutine(self._send_payload(make_request(request.method, request.id, request.params)))
+
+    def _fail_queued_requests(self, message: str):
+        requests = list(self._queued_requests.values())
+        self._queued_requests = {}
+        for request in requests:
+            if not request.result.done():
+                request.result.set_exception(Exception(message))
+
+    def _expire_queued_request(self, request_id: Any):
+        request = self._queued_requests.pop(request_id, None)
+        if request and not request.result.done():
+            request.result.set_exception(asyncio.TimeoutError(f'"{request.method}" ({request_id}) was not sent, {self.name} did not restart in {RESTART_QUEUE_TIMEOUT}s.'))
+
+    def abandon_request(self, request_id: Any) -> None:
+        """ Drop the response handler of a request nobody waits for, and ask the server to stop working on it. """
+        if self._queued_requests.pop(request_id, None) is not None:
+            return
+        if self._response_handlers.pop(request_id, None) is None:
+            return
+        self._cancelled_request_ids[request_id] = None
+        if len(self._cancelled_request_ids) > MAX_CANCELLED_REQUEST_IDS:
+            del self._cancelled_request_ids[next(iter(self._cancelled_request_ids))]
+        self.notify.cancel_request({
+            'id': request_id
+        })
 
     def _send_payload_sync(self, payload: dict) -> None:
         if not self._process or not self._process.stdin:
@@ -459,13 +929,20 @@ class LanguageServer:
         self.on_request_handlers[method] = cb
 
     def on_notification(self, method: str, cb):
-        self.on_notification_handlers.append({
-            'cb': cb,
-            'method': method
-        })
+        self.on_notification_handlers.setdefault(method, []).append(cb)
 
     async def _response_handler(self, server_response: dict) -> None:
-        request = self._response_handlers.pop(server_response["id"])
+        request_id = server_response["id"]
+        request = self._response_handlers.pop(request_id, None)
+        if request is None:
+            if request_id in self._cancelled_request_ids:
+                del self._cancelled_request_ids[request_id]
+                Metrics.increment('responses.dropped_cancelled')
+                return
+            self.console.log(f'Received response for an unknown request ({request_id})')
+            return
+        if request.result.done():
+            return
         request.request_end_time = datetime.datetime.now()
         if "__ignore" in server_response:
             self.console.log(f'Received response "{request.method}" ({request.id}) - {request.duration}s\nResponse is overridden to be "{format_payload(server_response["result"])}" because the original response is too large ({server_response["num_bytes"]})')
@@ -502,13 +979,16 @@ class LanguageServer:
     async def _notification_handler(self, response: dict) -> None:
         method = response.get("method", "")
         params = response.get("params")
-        handlers = [ handler['cb'] for handler in self.on_notification_handlers if handler['method'] == method]
+        handlers = self.on_notification_handlers.get(method)
+        if not handlers and method in HIGH_VOLUME_NOTIFICATIONS:
+            Metrics.increment('notifications.dropped')
+            return
         self.console.log(f'Received notification "{method}"\nParams: {format_payload(params)}')
         if not handlers:
             self._log(f"unhandled {method}")
             return
         try:
-            for handler in handlers:
+            for handler in list(handlers):
                 handler(params)
         except asyncio.CancelledError:
             return
@@ -2,9 +2,10 @@ from __future__ import annotations
 from typing import TYPE_CHECKING, Any, cast
 from .capabilities import method_to_capability
 from .view_to_lsp import get_view_uri, parse_uri
-from Mir.types.lsp import ApplyWorkspaceEditParams, ApplyWorkspaceEditResult, RegistrationParams, ShowMessageParams, UnregistrationParams, LogMessageParams, LogMessageParams, MessageType, ConfigurationParams, PublishDiagnosticsParams, DidChangeWatchedFilesRegistrationOptions, CreateFilesParams, RenameFilesParams, DeleteFilesParams, DidChangeWatchedFilesParams, WorkspaceFolder
-from .file_watcher import get_file_watcher, create_file_watcher
+from Mir.types.lsp import ApplyWorkspaceEditParams, ApplyWorkspaceEditResult, RegistrationParams, ShowMessageParams, UnregistrationParams, LogMessageParams, LogMessageParams, MessageType, ConfigurationParams, PublishDiagnosticsParams, DidChangeWatchedFilesRegistrationOptions, CreateFilesParams, RenameFilesParams, DeleteFilesParams, DidChangeWatchedFilesParams, WatchKind, WorkspaceFolder
+from .file_watcher import FileWatcherRegistrationOptions, FileWatchers, WatchPattern
 from .workspace_edit import apply_workspace_edit
+import functools
 import sublime
 if TYPE_CHECKING:
 	from .server import LanguageServer
@@ -36,7 +37,7 @@ def attach_server_request_and_notification_handlers(server: LanguageServer):
     register_provider_map = {}
     async def register_capability(params: RegistrationParams):
         from .lsp_providers import capabilities_to_lsp_providers
-        from .providers import register_provider
+        from .providers import register_provider, unregister_provider
         registrations = params["registrations"]
         for registration in registrations:
             capability_path = method_to_capability(registration["method"])
@@ -45,24 +46,34 @@ def attach_server_request_and_notification_handlers(server: LanguageServer):
                 options = {}
             if capability_path == 'workspace.didChangeWatchedFiles':
                 wacher_options = cast(DidChangeWatchedFilesRegistrationOptions, options)
-                watchers = wacher_options['watchers']
-                for folder in server.initialize_params.get('workspaceFolders', []):
-                    _, folder_name = parse_uri(folder['uri'])
-                    glob_patterns = [watcher['globPattern'] for watcher in watchers if isinstance(watcher['globPattern'], str)]
-                    watcher = get_file_watcher(folder_name)
-                    if watcher is None:
-                        watcher = create_file_watcher(folder_name)
-                    watcher.register(server.name, {
-                        'glob_patterns': glob_patterns,
-                        'on_did_create_files': on_did_create_files,
-                        'on_did_rename_files': on_did_rename_files,
-                        'on_did_delete_files': on_did_delete_files,
-                        'on_did_change_watched_files': on_did_change_watched_files,
-                    })
+                watch_patterns: list[WatchPattern] = []
+                for watcher in wacher_options['watchers']:
+                    kind = watcher.get('kind', WatchKind.Create | WatchKind.Change | WatchKind.Delete)
+                    glob_pattern = watcher['globPattern']
+                    if isinstance(glob_pattern, str):
+                        watch_patterns.append({'glob_pattern': glob_pattern, 'kind': kind})
+                    else:
+                        base_uri = glob_pattern['baseUri']
+                        _, base = parse_uri(base_uri if isinstance(base_uri, str) else base_uri['uri'])
+                        watch_patterns.append({'glob_pattern': glob_pattern['pattern'], 'kind': kind, 'base': base})
+                folders = [parse_uri(folder['uri'])[1] for folder in server.initialize_params.get('workspaceFolders') or []]
+                key = (id(server), registration['id'])
+                config: FileWatcherRegistrationOptions = {
+                    'folders': folders,
+                    'watchers': watch_patterns,
+                    'on_did_create_files': on_did_create_files,
+                    'on_did_rename_files': on_did_rename_files,
+                    'on_did_delete_files': on_did_delete_files,
+                    'on_did_change_watched_files': on_did_change_watched_files,
+                }
+                # relative patterns can point outside of the workspace folders
+                FileWatchers.register_folders(key, config)
+                server.before_shutdown.append(functools.partial(FileWatchers.unregister, key, config))
             if capability_path in capabilities_to_lsp_providers:
                 LspProvider = capabilities_to_lsp_providers[capability_path]
                 provider = LspProvider(server)
                 register_provider(provider)
+                server.before_shutdown.append(functools.partial(unregister_provider, provider))
                 if not capability_path in register_provider_map:
                     register_provider_map[capability_path] = []
                 register_provider_map[capability_path].append(provider)
@@ -75,14 +86,11 @@ def attach_server_request_and_notification_handlers(server: LanguageServer):
         for unregistration in unregisterations:
             capability_path = method_to_capability(unregistration["method"])
             server.capabilities.unregister(capability_path)
-            provider = register_provider_map.get(capability_path, []).pop()
-            if provider:
-                unregister_provider(provider)
+            providers = register_provider_map.get(capability_path)
+            if providers:
+                unregister_provider(providers.pop())
             if capability_path == 'workspace.didChangeWatchedFiles':
-                for folder in server.initialize_params.get('workspaceFolders', []):
-                    _, folder_name = parse_uri(folder['uri'])
-                    watcher = get_file_watcher(folder_name)
-                    # watcher.unregister(server.name) # pyright for some reason unregisters this capaability immediately afterm registering it
+                FileWatchers.unregister((id(server), unregistration['id']))
 
 
     def on_log_message(params: LogMessageParams):
@@ -122,7 +130,9 @@ def attach_server_request_and_notification_handlers(server: LanguageServer):
         return server.initialize_params.get('workspaceFolders', [])
 
     async def workspace_apply_edits(params: ApplyWorkspaceEditParams) -> ApplyWorkspaceEditResult:
-        view = server.window.active_view()
+        active_window = sublime.active_window()
+        window = active_window if active_window in server.windows else server.window
+        view = window.active_view()
         if not view:
             return {
                 'applied': False,
@@ -3,6 +3,7 @@ from typing import Iterable, TYPE_CHECKING
 
 from .manage_servers import servers_for_view
 from Mir.types.lsp import TextDocumentContentChangeEvent, TextDocumentSyncKind, TextDocumentSyncOptions
+from .line_index import LineIndexes
 from .view_to_lsp import get_view_uri
 import sublime_plugin
 import sublime
@@ -25,6 +26,7 @@ class MirTextChangeListener(sublime_plugin.TextChangeListener):
         incremental_changes: list[TextDocumentContentChangeEvent] = []
         if not changes:
             return
+        LineIndexes.on_text_changed(view, changes)
         incremental_changes = [text_change_to_text_document_content_change_event(text_change) for text_change in changes]
         servers = servers_for_view(view)
         for server in servers:
@@ -58,6 +60,16 @@ class MirTextChangeListener(sublime_plugin.TextChangeListener):
             debounce_func = functools.partial(self.debounce_sending_changes, server, view, last_change_count=view.change_count())
             sublime.set_timeout(debounce_func, 1000)
 
+    def on_reload(self) -> None:
+        view = self.buffer.primary_view()
+        if view:
+            LineIndexes.invalidate(view)
+
+    def on_revert(self) -> None:
+        view = self.buffer.primary_view()
+        if view:
+            LineIndexes.invalidate(view)
+
     def debounce_sending_changes(self, server: LanguageServer, view:sublime.View, last_change_count: int):
         if view.change_count() == last_change_count:
             server.send_did_change_text_document()
@@ -1,14 +1,21 @@
 from __future__ import annotations
-from typing import cast, Any
-from typing_extensions import TypeGuard
-from Mir.types.lsp import LanguageKind, Position, Range, TextDocumentItem, TextEdit, TextDocumentEdit
+from typing import cast, Any, Dict, Iterable, List
+from typing_extensions import TypedDict, TypeGuard
+from .line_index import LineIndexes
+from Mir.types.lsp import DocumentUri, LanguageKind, Position, Range, TextDocumentItem, TextEdit, TextDocumentEdit
 import sublime
 from urllib.parse import urlparse
 from urllib.request import url2pathname
 from urllib.request import pathname2url
+from functools import lru_cache
 import os
-import linecache
+import mmap
 import re
+import sys
+
+
+URI_CACHE_SIZE = 4096
+""" How many URIs and file names `parse_uri` and `file_name_to_uri` remember. """
 
 
 def view_to_text_document_item(view: sublime.View) -> TextDocumentItem :
@@ -25,37 +32,64 @@ def view_to_text_document_item(view: sublime.View) -> TextDocumentItem :
     }
 
 def point_to_position(view: sublime.View, point: int) -> Position:
-    row, col = view.rowcol(point)
-    return {
-        "line": row,
-        "character": col
-    }
+    return LineIndexes.get(view).point_to_position(point)
 
 def position_to_point(view: sublime.View, position: Position) -> int:
-    point = view.text_point(position['line'], position['character'],clamp_column=True)
-    return point
+    return LineIndexes.get(view).position_to_point(position)
+
+
+def points_to_positions(view: sublime.View, points: Iterable[int]) -> list[Position]:
+    """ Like `point_to_position`, but converts all points with one snapshot of the view. """
+    index = LineIndexes.get(view)
+    return [index.point_to_position(point) for point in points]
+
+
+def positions_to_points(view: sublime.View, positions: Iterable[Position]) -> list[int]:
+    """ Like `position_to_point`, but converts all positions with one snapshot of the view. """
+    index = LineIndexes.get(view)
+    return [index.position_to_point(position) for position in positions]
 
 
 def range_to_region(view: sublime.View, range: Range) -> sublime.Region:
-    a = position_to_point(view, range['start'])
-    b = position_to_point(view, range['end'])
+    index = LineIndexes.get(view)
+    a = index.position_to_point(range['start'])
+    b = index.position_to_point(range['end'])
     return sublime.Region(a, b)
 
 
 def region_to_range(view: sublime.View, region: sublime.Region) -> Range:
+    index = LineIndexes.get(view)
     return {
-        'start': point_to_position(view, region.begin()),
-        'end': point_to_position(view, region.end()),
+        'start': index.point_to_position(region.begin()),
+        'end': index.point_to_position(region.end()),
     }
 
+
+def ranges_to_regions(view: sublime.View, ranges: Iterable[Range]) -> list[sublime.Region]:
+    """ Like `range_to_region`, but converts all ranges with one snapshot of the view. """
+    to_point = LineIndexes.get(view).position_to_point
+    return [sublime.Region(to_point(r['start']), to_point(r['end'])) for r in ranges]
+
+
+def regions_to_ranges(view: sublime.View, regions: Iterable[sublime.Region]) -> list[Range]:
+    """ Like `region_to_range`, but converts all regions with one snapshot of the view. """
+    to_position = LineIndexes.get(view).point_to_position
+    return [{'start': to_position(r.begin()), 'end': to_position(r.end())} for r in regions]
+
 def _view_to_uri(view) -> str:
     file_name = view.file_name()
     if not file_name:
         return f"buffer:{view.buffer_id()}"
     return file_name_to_uri(file_name)
 
-def file_name_to_uri(file_name: str) -> str:
-    return 'file://' + pathname2url(file_name)
+@lru_cache(maxsize=URI_CACHE_SIZE)
+def file_name_to_uri(file_name: str) -> DocumentUri:
+    return intern_uri('file://' + pathname2url(file_name))
+
+
+def intern_uri(uri: str) -> DocumentUri:
+    """ Returns the canonical instance of the URI string, so dicts keyed by URI compare them by identity. """
+    return sys.intern(uri)
 
 async def open_view_with_uri(uri: str, lsp_range: Range, view: sublime.View) -> sublime.View:
     window = view.window()
@@ -93,6 +127,7 @@ def move_cursor_to(view: sublime.View, point: int) -> None:
         view.show_at_center(point)
 
 
+@lru_cache(maxsize=URI_CACHE_SIZE)
 def parse_uri(uri: str) -> tuple[str, str]:
     """
     Parses an URI into a tuple where the first element is the URI scheme. The
@@ -126,55 +161,66 @@ def _uppercase_driveletter(match: Any) -> str:
     return f"{match.group(1).upper()}:"
 
 
-def get_view_uri(view) -> str:
+def get_view_uri(view) -> DocumentUri:
     uri = view.settings().get("mir_text_document_uri")
     if not uri:
         uri = _view_to_uri(view)
         view.settings().set("mir_text_document_uri", uri)
-    return uri
+    return intern_uri(uri)
+
+
+SELECTOR_TO_LANGUAGE_ID: Dict[str, str] = {
+    "source.c++": "cpp",
+    "source.coffee": "coffeescript",
+    "source.cs": "csharp",
+    "source.dosbatch": "bat",
+    "source.fixedform-fortran": "fortran", # https://packagecontrol.io/packages/Fortran
+    "source.js": "javascript",
+    "source.js.react": "javascriptreact", # https://github.com/Thom1729/Sublime-JS-Custom
+    "source.json-tmlanguage": "jsonc", # https://github.com/SublimeText/PackageDev
+    "source.json.sublime": "jsonc", # https://github.com/SublimeText/PackageDev
+    "source.jsx": "javascriptreact",
+    "source.Kotlin": "kotlin", # https://github.com/vkostyukov/kotlin-sublime-package
+    "source.modern-fortran": "fortran", # https://packagecontrol.io/packages/Fortran
+    "source.objc": "objective-c",
+    "source.objc++": "objective-cpp",
+    "source.shader": "shaderlab", # https://github.com/waqiju/unity_shader_st3
+    "source.shell": "shellscript",
+    "source.ts": "typescript",
+    "source.ts.react": "typescriptreact", # https://github.com/Thom1729/Sublime-JS-Custom
+    "source.tsx": "typescriptreact",
+    "source.unity.unity_shader": "shaderlab", # https://github.com/petereichinger/Unity3D-Shader
+    "source.yaml-tmlanguage": "yaml", # https://github.com/SublimeText/PackageDev
+    "text.advanced_csv": "csv", # https://github.com/SublimeText/AFileIcon
+    "text.django": "html", # https://github.com/willstott101/django-sublime-syntax
+    "text.html.handlebars": "handlebars",
+    "text.html.markdown": "markdown",
+    "text.html.markdown.rmarkdown": "r", # https://github.com/REditorSupport/sublime-ide-r
+    "text.html.vue": "vue",
+    "text.jinja": "html", # https://github.com/Sublime-Instincts/BetterJinja
+    "text.plain": "plaintext",
+    "text.plist": "xml", # https://bitbucket.org/fschwehn/sublime_plist
+    "text.tex.latex": "latex",
+    "text.xml.xsl": "xsl",
+}
+
+
+def register_language_id(selector: str, language_id: str) -> None:
+    """
+    Maps a syntax scope (like `source.mdx`) to a LSP language id,
+    for syntaxes where the second component of the scope is not the language id.
+    """
+    SELECTOR_TO_LANGUAGE_ID[selector] = language_id
+    selector_to_language_id.cache_clear()
 
 
+@lru_cache(maxsize=512)
 def selector_to_language_id(selector: str) -> str:
-    selector_to_language_id_map = {
-        "source.c++": "cpp",
-        "source.coffee": "coffeescript",
-        "source.cs": "csharp",
-        "source.dosbatch": "bat",
-        "source.fixedform-fortran": "fortran", # https://packagecontrol.io/packages/Fortran
-        "source.js": "javascript",
-        "source.js.react": "javascriptreact", # https://github.com/Thom1729/Sublime-JS-Custom
-        "source.json-tmlanguage": "jsonc", # https://github.com/SublimeText/PackageDev
-        "source.json.sublime": "jsonc", # https://github.com/SublimeText/PackageDev
-        "source.jsx": "javascriptreact",
-        "source.Kotlin": "kotlin", # https://github.com/vkostyukov/kotlin-sublime-package
-        "source.modern-fortran": "fortran", # https://packagecontrol.io/packages/Fortran
-        "source.objc": "objective-c",
-        "source.objc++": "objective-cpp",
-        "source.shader": "shaderlab", # https://github.com/waqiju/unity_shader_st3
-        "source.shell": "shellscript",
-        "source.ts": "typescript",
-        "source.ts.react": "typescriptreact", # https://github.com/Thom1729/Sublime-JS-Custom
-        "source.tsx": "typescriptreact",
-        "source.unity.unity_shader": "shaderlab", # https://github.com/petereichinger/Unity3D-Shader
-        "source.yaml-tmlanguage": "yaml", # https://github.com/SublimeText/PackageDev
-        "text.advanced_csv": "csv", # https://github.com/SublimeText/AFileIcon
-        "text.django": "html", # https://github.com/willstott101/django-sublime-syntax
-        "text.html.handlebars": "handlebars",
-        "text.html.markdown": "markdown",
-        "text.html.markdown.rmarkdown": "r", # https://github.com/REditorSupport/sublime-ide-r
-        "text.html.vue": "vue",
-        "text.jinja": "html", # https://github.com/Sublime-Instincts/BetterJinja
-        "text.plain": "plaintext",
-        "text.plist": "xml", # https://bitbucket.org/fschwehn/sublime_plist
-        "text.tex.latex": "latex",
-        "text.xml.xsl": "xsl",
-    }
-
     result = ""
     # Try to find exact match or less specific match consisting of at least 2 components.
     scope_parts = selector.split('.')
     while len(scope_parts) >= 2:
-        result = selector_to_language_id_map.get('.'.join(scope_parts))
+        result = SELECTOR_TO_LANGUAGE_ID.get('.'.join(scope_parts))
         if result:
             break
         scope_parts.pop()
@@ -222,27 +268,95 @@ def get_project_path(file_path: str) -> str | None:
 
 def get_lines(window: sublime.Window, file_name: str, start_line: int, end_line:int|None = None) -> str:
     '''
-    Get the line from the buffer if the view is open, else get line from linecache.
+    Get the line from the buffer if the view is open, else get line from the file.
     start_line and end_line - are 0 based. If you want to get the first line, you should pass 0.
+    To get many lines, use a `LineReader`, it reads every file only once.
     '''
-    view = window.find_open_file(file_name)
-    if view:
-        if end_line is not None:
-            start_point = view.text_point(start_line , 0)
-            end_point = view.text_point(end_line , 0)
-            return view.substr(sublime.Region(view.line(start_point).begin(), view.line(end_point).end()))
-        else:
-            point = view.text_point(start_line , 0)
-            return view.substr(view.line(point))
-    else:
-        # get from linecache
-        if end_line is not None:
-            lines = []
-            for line_index in range(start_line, end_line + 1):
-                lines.append(linecache.getline(file_name, line_index + 1).strip('\n'))
-            linecache.clearcache()
-            return '\n'.join(lines)
-        else:
-            line = linecache.getline(file_name, start_line + 1)
-            linecache.clearcache()
-            return line
+    return LineReader(window).get_lines(file_name, start_line, end_line)
+
+
+MMAP_THRESHOLD = 1024 * 1024
+""" Files larger than this (in bytes) are mapped, and only decoded up to the last requested line. """
+
+
+class FileSnapshot(TypedDict):
+    mtime: float
+    size: int
+    lines: List[str]
+    complete: bool
+    """ False if the file was only read up to the last requested line. """
+
+
+class LineReader:
+    """
+    Gets lines from the open views of a window, or from the files on disk.
+    Files are read once and kept by (path, mtime, size) for the lifetime of the reader,
+    so create one reader per command and drop it after.
+    """
+    def __init__(self, window: sublime.Window):
+        self.window = window
+        self._snapshots: Dict[str, FileSnapshot] = {}
+
+    def get_lines(self, file_name: str, start_line: int, end_line: int | None = None) -> str:
+        return self.get_many([(file_name, start_line, end_line)])[0]
+
+    def get_many(self, requests: Iterable[tuple[str, int, int | None]]) -> list[str]:
+        """ Like `get_lines` for every (file_name, start_line, end_line) request, the files are read in one pass. """
+        requests = list(requests)
+        last_lines: Dict[str, int] = {}
+        for file_name, start_line, end_line in requests:
+            last_lines[file_name] = max(last_lines.get(file_name, 0), start_line if end_line is None else end_line)
+        views = {file_name: self.window.find_open_file(file_name) for file_name in last_lines}
+        view_lines = {file_name: LineIndexes.get(view).lines for file_name, view in views.items() if view}
+        file_lines = {file_name: self._read(file_name, last_line) for file_name, last_line in last_lines.items() if not views[file_name]}
+        result: list[str] = []
+        for file_name, start_line, end_line in requests:
+            if file_name in view_lines:
+                # like view.text_point, rows after the last line point to the last line
+                lines = view_lines[file_name]
+                last = len(lines) - 1
+                result.append('\n'.join(lines[min(start_line, last):min(start_line if end_line is None else end_line, last) + 1]))
+                continue
+            lines = file_lines[file_name]
+            if end_line is not None:
+                result.append('\n'.join(lines[row] if row < len(lines) else '' for row in range(start_line, end_line + 1)))
+            elif start_line < len(lines) and (start_line < len(lines) - 1 or lines[start_line]):
+                # with a line ending, like `linecache.getline`
+                result.append(lines[start_line] + '\n')
+            else:
+                result.append('')
+        return result
+
+    def _read(self, file_name: str, last_line: int) -> List[str]:
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return []
+        snapshot = self._snapshots.get(file_name)
+        if snapshot and snapshot['mtime'] == stat.st_mtime and snapshot['size'] == stat.st_size \
+                and (snapshot['complete'] or last_line < len(snapshot['lines']) - 1):
+            return snapshot['lines']
+        try:
+            with open(file_name, 'rb') as f:
+                if stat.st_size < MMAP_THRESHOLD:
+                    data, complete = f.read(), True
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                        data, complete = read_until_line(m, last_line)
+        except (OSError, ValueError):
+            return []
+        text = data.decode('utf-8', 'replace').replace('\r\n', '\n').replace('\r', '\n')
+        # a partial read ends with a line ending, the empty line after it stands for the rest of the file
+        lines = text.split('\n')
+        self._snapshots[file_name] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'lines': lines, 'complete': complete}
+        return lines
+
+
+def read_until_line(m: mmap.mmap, last_line: int) -> tuple[bytes, bool]:
+    """ Returns the bytes up to and including the (0 based) `last_line`, and True if that is the whole file. """
+    end = -1
+    for _ in range(last_line + 1):
+        end = m.find(b'\n', end + 1)
+        if end == -1:
+            return m[:], True
+    return m[:end + 1], end + 1 == len(m)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+from Mir import mir_logger
+from .metrics import Metrics
+from .server import LanguageServer, settings_hash
+from typing import List
+from typing_extensions import TypedDict
+import asyncio
+import sublime
+import sublime_aio
+
+
+WARM_POOL_SIZE = 0
+""" How many servers are kept running after their window closes, 0 disables the warm pool. Overridden by the `mir.warm_pool_size` setting. """
+WARM_POOL_TIMEOUT = 300
+""" Seconds a server is kept in the warm pool. Overridden by the `mir.warm_pool_timeout` setting. """
+
+
+class WarmServer(TypedDict):
+    server: LanguageServer
+    folders: list[str]
+    expire_task: asyncio.Future
+
+
+class WarmPool:
+    """
+    Initialized servers whose window was closed.
+    A new window with the same workspace folders and settings reuses one of them instead of spawning a new process.
+    """
+    servers: List[WarmServer] = []  # oldest first
+
+    @staticmethod
+    def park(server: LanguageServer, window: sublime.Window) -> bool:
+        """ Returns False if the server was not parked and should be stopped. """
+        settings = sublime.load_settings('Mir.sublime-settings')
+        size: int = settings.get('mir.warm_pool_size', WARM_POOL_SIZE)
+        timeout: float = settings.get('mir.warm_pool_timeout', WARM_POOL_TIMEOUT)
+        if size <= 0 or not server.is_running():
+            return False
+        if server.activation_events.get('on_uri'):  # those servers are tied to the views that started them
+            return False
+        server.detach()
+        WarmPool.servers.append({
+            'server': server,
+            'folders': window.folders(),
+            # park is called from the Sublime callback thread, the timer runs on the sublime_aio loop
+            'expire_task': sublime_aio.run_coroutine(WarmPool._expire_later(server, timeout))
+        })
+        while len(WarmPool.servers) > size:
+            WarmPool._stop(WarmPool.servers.pop(0))
+        Metrics.set_gauge('warm_pool.size', len(WarmPool.servers))
+        mir_logger.info(f'Mir ({server.name}) kept in the warm pool.')
+        return True
+
+    @staticmethod
+    def take(server_class: type[LanguageServer], view: sublime.View) -> LanguageServer | None:
+        """ Removes and returns a parked server that can be reattached to the window of the view. """
+        window = view.window()
+        if not window or not WarmPool.servers:
+            return None
+        folders = window.folders()
+        expected_hash = settings_hash(server_class.settings_for_view(view).get())
+        candidates = [w for w in WarmPool.servers if w['server'].name == server_class.name and w['server'].settings_hash == expected_hash and w['server'].is_running()]
+        # prefer a server that already has the same folders, otherwise the server must support changing them
+        warm = next(iter([w for w in candidates if w['folders'] == folders]), None) \
+            or next(iter([w for w in candidates if w['server'].supports_workspace_folder_changes()]), None)
+        if warm is None:
+            Metrics.increment('warm_pool.misses')
+            return None
+        WarmPool.servers = [w for w in WarmPool.servers if w is not warm]
+        warm['expire_task'].cancel()
+        Metrics.increment('warm_pool.hits')
+        Metrics.set_gauge('warm_pool.size', len(WarmPool.servers))
+        return warm['server']
+
+    @staticmethod
+    def remove(name: str):
+        """ Stops the parked servers with the given name. """
+        for warm in [w for w in WarmPool.servers if w['server'].name == name]:
+            WarmPool.servers = [w for w in WarmPool.servers if w is not warm]
+            WarmPool._stop(warm)
+        Metrics.set_gauge('warm_pool.size', len(WarmPool.servers))
+
+    @staticmethod
+    async def _expire_later(server: LanguageServer, timeout: float):
+        await asyncio.sleep(timeout)
+        WarmPool._expire(server)
+
+    @staticmethod
+    def _expire(server: LanguageServer):
+        warm = next(iter([w for w in WarmPool.servers if w['server'] is server]), None)
+        if warm is None:
+            return
+        WarmPool.servers = [w for w in WarmPool.servers if w is not warm]
+        WarmPool._stop(warm)
+        Metrics.set_gauge('warm_pool.size', len(WarmPool.servers))
+
+    @staticmethod
+    def _stop(warm: WarmServer):
+        warm['expire_task'].cancel()
+        warm['server'].stop()
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from Mir import get_relative_path, selector_to_language_id, get_lines
+from Mir import get_relative_path, selector_to_language_id, LineReader
 import sublime
 from typing_extensions import TypedDict, cast, Union, Literal
 
@@ -9,6 +9,7 @@ class Multibuffer:
         self.syntax = "Packages/Markdown/Markdown.sublime-syntax"
         self.id = id
         self.window = window
+        self.line_reader = LineReader(window)
 
     def open(self, tab_title, content: list[MultibufferContent], flags:sublime.NewFileFlags=sublime.NewFileFlags.NONE) -> sublime.View:
         [v.close() for v in self.window.views() if v.settings().get('is_mir_references_view', False)]
@@ -21,6 +22,8 @@ class Multibuffer:
 
     def render(self, view: sublime.View, multibuffer_content: list[MultibufferContent]):
         rendered_content = ''
+        buffers = [content for content in multibuffer_content if not isinstance(content, str)]
+        lines = iter(self.line_reader.get_many([(b['file_path'], b['start_line'], b['end_line']) for b in buffers]))
         for content in multibuffer_content:
             if isinstance(content, str):
                 rendered_content += content + "\n"
@@ -32,8 +35,7 @@ class Multibuffer:
                 if syntax:
                     language_id = selector_to_language_id(syntax.scope)
                 start_line = content['start_line']
-                end_line = content['end_line']
-                line_content = get_lines(self.window, file_path, start_line, end_line)
+                line_content = next(lines)
                 rendered_content += f"""```{language_id} {relative_file_path}:{start_line+1}\n{line_content}\n```\n"""
 
         view.run_command("append", {
@@ -6,11 +6,19 @@ import shutil
 import asyncio
 import os
 import zipfile
+import urllib.error
 import urllib.request
+import hashlib
 import subprocess
 import sublime_aio
 import tarfile
 import sys
+import re
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Mir import LoaderInStatusBar
 
 class PackageStorage:
     def __init__(self, tag: str):
@@ -33,16 +41,35 @@ class PackageStorage:
             raise Exception(f'"NAME" must match Package Name, but it was called with PackageStorage("{self.name}")')
         self._storage_dir.mkdir(parents=True, exist_ok=True)
 
-    async def download(self, url: str, save_to_path: Path) -> None:
+    async def download(self, url: str, save_to_path: Path, sha256: str | None = None, progress: LoaderInStatusBar | None = None) -> None:
+        """
+        Download `url` to `save_to_path` in a worker thread, so the event loop is not blocked.
+        The file is written to `save_to_path.part` first and renamed when complete,
+        an interrupted download is resumed from the `.part` file with an HTTP range request.
+        If `sha256` is given, the download is verified against it.
+        If `progress` is given, its label shows the download percentage.
+        """
         if save_to_path.exists():
             return
-        async def download_sync():
-            with urllib.request.urlopen(url) as response:
-                save_to_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(save_to_path, 'wb') as f:
-                    shutil.copyfileobj(response, f)
-                    return
-        await download_sync()
+        on_progress = progress_callback(progress) if progress else None
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, download_sync, url, save_to_path, sha256, on_progress)
+
+    async def download_and_extract(self, url: str, extract_to: Path, sha256: str | None = None, progress: LoaderInStatusBar | None = None) -> None:
+        """ Download a .tar.gz and extract it to `extract_to` while it downloads, in a worker thread. """
+        if extract_to.exists():
+            return
+        on_progress = progress_callback(progress) if progress else None
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, download_and_extract_sync, url, extract_to, sha256, on_progress)
+
+    async def fetch_text(self, url: str) -> str:
+        """ Fetch a small text file, like a checksums file, in a worker thread. """
+        def fetch_sync():
+            with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+                return response.read().decode('utf-8')
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, fetch_sync)
 
     def rm(self, relative_path):
         """ Remove folder/file from Package Storage """
@@ -69,32 +96,292 @@ class PackageStorage:
         return self._storage_dir / other
 
 
+def progress_callback(progress: LoaderInStatusBar) -> Callable[[int, int | None], None]:
+    """ Returns a callback that shows the download progress next to the label of `progress`. """
+    label = progress.label
+    def on_progress(downloaded: int, total: int | None):
+        progress.label = f'{label} {downloaded * 100 // total}%' if total else f'{label} {downloaded // 1_000_000}MB'
+    return on_progress
+
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = 30 # seconds without receiving data
+
+
+def download_sync(url: str, save_to_path: Path, sha256: str | None = None, on_progress: Callable[[int, int | None], None] | None = None) -> None:
+    save_to_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = save_to_path.with_name(save_to_path.name + '.part')
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header('Range', f'bytes={offset}-')
+    try:
+        response = urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code != 416: # Range Not Satisfiable, the .part file is stale
+            raise
+        part_path.unlink()
+        return download_sync(url, save_to_path, sha256, on_progress)
+    with response:
+        if response.status != 206: # the server ignored the range header, start from the beginning
+            offset = 0
+        content_length = response.headers.get('Content-Length')
+        total = offset + int(content_length) if content_length else None
+        hash = hashlib.sha256()
+        if offset:
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    hash.update(chunk)
+        downloaded = offset
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+                f.write(chunk)
+                hash.update(chunk)
+                downloaded += len(chunk)
+                if on_progress:
+                    on_progress(downloaded, total)
+    if total is not None and downloaded != total:
+        raise Exception(f'Mir: Downloading {url} ended after {downloaded} of {total} bytes, it will resume on the next try.')
+    if sha256 and hash.hexdigest().lower() != sha256.lower():
+        part_path.unlink()
+        raise Exception(f'Mir: Checksum mismatch for {url}, expected {sha256} but got {hash.hexdigest()}.')
+    os.replace(part_path, save_to_path)
+
+
+def find_checksum(checksums: str, file_name: str) -> str | None:
+    """ Find the checksum of `file_name` in the content of a `sha256sum` style file (`<hash>  <file name>` per line). """
+    for line in checksums.splitlines():
+        parts = line.split()
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) == 2 and parts[1].lstrip('*') == file_name:
+            return parts[0]
+    return None
+
+
+INSTALL_COMPLETE_MARKER = '.mir-install-complete'
+INSTALL_LOCK_FILE = '.mir-install.lock'
+# directory -> in flight install
+_installs: dict[str, asyncio.Future] = {}
+
+
+async def install_once(directory: Path, install: Callable[[], Awaitable[None]]) -> None:
+    """
+    Run `install` for `directory` unless it already completed.
+    Concurrent callers in this process await the same install,
+    and a file lock keeps other processes (other Sublime Text instances) from installing at the same time.
+    An install only counts as done once the completion marker is written.
+    """
+    if (directory / INSTALL_COMPLETE_MARKER).exists():
+        return
+    key = str(directory)
+    in_flight = _installs.get(key)
+    if in_flight is None:
+        in_flight = asyncio.ensure_future(_install_with_file_lock(directory, install))
+        _installs[key] = in_flight
+        in_flight.add_done_callback(lambda _: _installs.pop(key, None))
+    # shield, so a cancelled caller does not cancel the install for everyone else
+    await asyncio.shield(in_flight)
+
+
+async def _install_with_file_lock(directory: Path, install: Callable[[], Awaitable[None]]) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    lock = FileLock(directory / INSTALL_LOCK_FILE)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, lock.acquire)
+    try:
+        marker = directory / INSTALL_COMPLETE_MARKER
+        if marker.exists(): # another process finished the install while we waited for the lock
+            return
+        await install()
+        marker.touch()
+    finally:
+        lock.release()
+
+
+class FileLock:
+    """ An exclusive lock on a file, shared between processes. `acquire` blocks, call it from a worker thread. """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> None:
+        self._file = open(self.path, 'a+')
+        if is_windows:
+            import msvcrt
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1) # type: ignore
+                    return
+                except OSError: # LK_LOCK gives up after 10 seconds
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def release(self) -> None:
+        if not self._file:
+            return
+        try:
+            if is_windows:
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1) # type: ignore
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+
 def unzip(archive_path: Path, new_name: str | None=None) -> None: # archive will be `folder/some.zip`
-    filename: str = archive_path.name # file name will be `some.zip`
-    where_to_extract: str = str(archive_path.parent / archive_path.stem) # will be `folder/some` if new_name is not provided
-    if new_name:
-        where_to_extract = str(archive_path.parent / new_name)
+    """
+    Extract a .zip or .tar.gz archive next to it, into `folder/some` or `folder/new_name`.
+    The archive is extracted into a `.partial` folder first, which is renamed when extraction is complete.
+    Blocking, use `extract` from async code.
+    """
+    where_to_extract = archive_path.parent / (new_name or archive_path.stem)
+    partial = where_to_extract.with_name(where_to_extract.name + '.partial')
+    if partial.exists():
+        shutil.rmtree(partial)
     try:
-        if sublime.platform() == 'windows':
-             with zipfile.ZipFile(str(archive_path)) as f:
-                names = f.namelist()
-                _, _ = next(x for x in names if '/' in x).split('/', 1)
-                bad_members = [x for x in names if x.startswith('/') or x.startswith('..')]
-                if bad_members:
-                    raise Exception('{} appears to be malicious, bad filenames: {}'.format(filename, bad_members))
-                f.extractall(where_to_extract)
-        elif str(archive_path).endswith('.zip'):
-            _, error = run_command_sync(['unzip', str(archive_path), '-d', where_to_extract], cwd=str(archive_path.parent))
-            if error:
-                raise Exception('Error unzipping electron archive: {}'.format(error))
+        if str(archive_path).endswith('.zip'):
+            _extract_zip(archive_path, partial)
         elif str(archive_path).endswith('.tar.gz'):
-             with tarfile.open(archive_path) as f:
-                 f.extractall(where_to_extract)
+            with tarfile.open(archive_path) as f:
+                _extract_tar_members(f, partial)
         else:
             raise Exception(f'Mir: Failed unzipping this file: {archive_path}')
+    except Exception:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    if where_to_extract.exists():
+        shutil.rmtree(where_to_extract)
+    os.replace(partial, where_to_extract)
+
+
+async def extract(archive_path: Path, new_name: str | None=None) -> None:
+    """ Same as `unzip`, but runs in a worker thread so the event loop is not blocked. """
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, unzip, archive_path, new_name)
+
+
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def safe_join(destination: Path, member_name: str) -> Path:
+    """ Returns where `member_name` should be extracted to, raises if it would end up outside of `destination`. """
+    normalized = member_name.replace('\\', '/')
+    if normalized.startswith('/') or re.match(r'^[a-zA-Z]:', normalized) or '..' in normalized.split('/'):
+        raise Exception(f'Mir: Archive appears to be malicious, bad filename: {member_name}')
+    return destination / normalized
+
+
+def _check_link(destination: Path, link_path: Path, link_target: str) -> None:
+    root = os.path.abspath(destination)
+    resolved = os.path.normpath(os.path.join(os.path.abspath(os.path.dirname(link_path)), link_target))
+    if os.path.isabs(link_target) or os.path.commonpath([resolved, root]) != root:
+        raise Exception(f'Mir: Archive appears to be malicious, {link_path} links outside of the archive to {link_target}')
+
+
+def _extract_zip(archive_path: Path, destination: Path) -> None:
+    """
+    Extract zip members in parallel, each worker with its own file handle (zlib releases the GIL).
+    Unix permissions and symlinks are restored, `zipfile.extractall` drops them.
+    """
+    with zipfile.ZipFile(archive_path) as f:
+        members = f.infolist()
+    files: list[zipfile.ZipInfo] = []
+    links: list[zipfile.ZipInfo] = []
+    for info in members:
+        target = safe_join(destination, info.filename)
+        if info.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+        elif stat.S_ISLNK(info.external_attr >> 16):
+            links.append(info)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            files.append(info)
+
+    def extract_chunk(chunk: list[zipfile.ZipInfo]) -> None:
+        with zipfile.ZipFile(archive_path) as f:
+            for info in chunk:
+                target = destination / info.filename.replace('\\', '/')
+                with f.open(info) as source, open(target, 'wb') as out:
+                    shutil.copyfileobj(source, out, DOWNLOAD_CHUNK_SIZE)
+                mode = (info.external_attr >> 16) & 0o777
+                if mode:
+                    os.chmod(target, mode)
+
+    chunks = [files[i::EXTRACT_WORKERS] for i in range(EXTRACT_WORKERS)]
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        for future in [executor.submit(extract_chunk, chunk) for chunk in chunks if chunk]:
+            future.result()
+
+    # links last, so a link can never redirect where a file is written
+    if links:
+        with zipfile.ZipFile(archive_path) as f:
+            for info in links:
+                target = destination / info.filename.replace('\\', '/')
+                link_target = f.read(info).decode('utf-8')
+                _check_link(destination, target, link_target)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.symlink(link_target, target)
+
+
+def _extract_tar_members(f: tarfile.TarFile, destination: Path) -> None:
+    """ Works with streamed archives (mode `r|gz`), members are extracted in the order they are read. """
+    destination.mkdir(parents=True, exist_ok=True)
+    for member in f:
+        target = safe_join(destination, member.name)
+        if member.issym():
+            _check_link(destination, target, member.linkname)
+        elif member.islnk():
+            safe_join(destination, member.linkname)
+        elif not (member.isfile() or member.isdir()):
+            continue # skip devices and fifos
+        f.extract(member, str(destination))
+
+
+class _HashingReader:
+    """ File like object that hashes and counts what is read through it. """
+    def __init__(self, response, total: int | None, on_progress: Callable[[int, int | None], None] | None) -> None:
+        self.response = response
+        self.total = total
+        self.on_progress = on_progress
+        self.hash = hashlib.sha256()
+        self.downloaded = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.response.read(size)
+        self.hash.update(chunk)
+        self.downloaded += len(chunk)
+        if self.on_progress:
+            self.on_progress(self.downloaded, self.total)
+        return chunk
+
 
-    except Exception as ex:
-        raise ex
+def download_and_extract_sync(url: str, extract_to: Path, sha256: str | None = None, on_progress: Callable[[int, int | None], None] | None = None) -> None:
+    """ Extract a .tar.gz while it is downloading, without saving the archive. """
+    partial = extract_to.with_name(extract_to.name + '.partial')
+    if partial.exists():
+        shutil.rmtree(partial)
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+        content_length = response.headers.get('Content-Length')
+        reader = _HashingReader(response, int(content_length) if content_length else None, on_progress)
+        with tarfile.open(fileobj=reader, mode='r|gz') as f:
+            _extract_tar_members(f, partial)
+        # read what is left after the end of the archive, so the checksum covers the whole file
+        for _ in iter(lambda: reader.read(DOWNLOAD_CHUNK_SIZE), b''):
+            pass
+    if sha256 and reader.hash.hexdigest().lower() != sha256.lower():
+        shutil.rmtree(partial)
+        raise Exception(f'Mir: Checksum mismatch for {url}, expected {sha256} but got {reader.hash.hexdigest()}.')
+    if extract_to.exists():
+        shutil.rmtree(extract_to)
+    os.replace(partial, extract_to)
 
 
 is_windows = sublime.platform() == 'windows'
@@ -1,13 +1,22 @@
 from __future__ import annotations
 from typing import Literal
-from .package_storage import PackageStorage, unzip
+from .package_storage import PackageStorage, extract, find_checksum, install_once
 import sublime
 import os
-from Mir import LoaderInStatusBar
+from Mir import LoaderInStatusBar, mir_logger
 from pathlib import Path
 
 runtime_storage_path = PackageStorage(tag='runtime')
 
+
+async def fetch_checksum(checksums_url: str, file_name: str) -> str | None:
+    """ Returns the published sha256 of `file_name`, or None if the checksums file can not be fetched. """
+    try:
+        return find_checksum(await runtime_storage_path.fetch_text(checksums_url), file_name)
+    except Exception as e:
+        mir_logger.warning(f'Mir: Could not fetch {checksums_url}, {file_name} will not be verified.', exc_info=e)
+        return None
+
 class Yarn:
     def __init__(self) -> None:
         self.package_storage = runtime_storage_path / 'yarn'
@@ -17,10 +26,13 @@ class Yarn:
         return self.package_storage / 'yarn.js'
 
     async def setup(self):
-        with LoaderInStatusBar(f'Downloading Yarn'):
+        await install_once(self.package_storage, self._install)
+
+    async def _install(self):
+        with LoaderInStatusBar(f'Downloading Yarn') as loader:
             yarn_url = 'https://github.com/yarnpkg/yarn/releases/download/v1.22.22/yarn-1.22.22.js'
             save_to = self.package_storage / 'yarn.js'
-            await runtime_storage_path.download(yarn_url, save_to)
+            await runtime_storage_path.download(yarn_url, save_to, progress=loader)
 
 
 DenoVersion = Literal['2.2',]
@@ -37,12 +49,16 @@ class Deno:
         return str(self.package_storage / 'deno' / 'deno')
 
     async def setup(self):
-        with LoaderInStatusBar(f'Downloading Deno {self.deno_version}'):
+        await install_once(self.package_storage, self._install)
+
+    async def _install(self):
+        with LoaderInStatusBar(f'Downloading Deno {self.deno_version}') as loader:
             fetch_url, archive_filename = self._archive_on_github()
             if not Path(self.path).exists():
                 save_to = self.package_storage / archive_filename
-                await runtime_storage_path.download(fetch_url, save_to)
-                unzip(save_to, new_name='deno')
+                sha256 = await fetch_checksum(f'{fetch_url}.sha256sum', archive_filename)
+                await runtime_storage_path.download(fetch_url, save_to, sha256=sha256, progress=loader)
+                await extract(save_to, new_name='deno')
             
     def _archive_on_github(self) -> tuple[str, str]:
         platform = sublime.platform()
@@ -105,12 +121,17 @@ class Electron:
         return binary_path
 
     async def setup(self):
-        with LoaderInStatusBar(f'Downloading Node.js {self.node_version}'):
+        await install_once(self.package_storage, self._install)
+
+    async def _install(self):
+        with LoaderInStatusBar(f'Downloading Node.js {self.node_version}') as loader:
             fetch_url, archive_filename = self._archive_on_github()
             if not Path(self.path).exists():
                 save_to = self.package_storage / archive_filename
-                await runtime_storage_path.download(fetch_url, save_to)
-                unzip(save_to, new_name='electron')
+                checksums_url = fetch_url.rsplit('/', 1)[0] + '/SHASUMS256.txt'
+                sha256 = await fetch_checksum(checksums_url, archive_filename)
+                await runtime_storage_path.download(fetch_url, save_to, sha256=sha256, progress=loader)
+                await extract(save_to, new_name='electron')
 
             
     def _archive_on_github(self) -> tuple[str, str]:
@@ -0,0 +1,24 @@
+from __future__ import annotations
+from .libs.lsp.metrics import Metrics
+import sublime_plugin
+
+
+class mir_show_metrics_command(sublime_plugin.WindowCommand):
+    def run(self):
+        view = next(iter([v for v in self.window.views() if v.settings().get('is_mir_metrics_view', False)]), None)
+        if view is None:
+            view = self.window.new_file()
+            view.set_scratch(True)
+            view.set_name('Mir Metrics')
+            view.settings().set('is_mir_metrics_view', True)
+        view.set_read_only(False)
+        view.run_command('select_all')
+        view.run_command('right_delete')
+        view.run_command('append', {
+            'characters': Metrics.format(),
+            'force': False,
+            'scroll_to_end': False
+        })
+        view.set_read_only(True)
+        view.clear_undo_stack()
+        self.window.focus_view(view)
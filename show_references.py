@@ -3,7 +3,7 @@ from __future__ import annotations
 from Mir import apply_workspace_edit
 from .multibuffer import Multibuffer, MultibufferContent
 
-from .libs.lsp.view_to_lsp import get_lines, get_relative_path, is_text_edit
+from .libs.lsp.view_to_lsp import get_relative_path, is_text_edit
 import sublime_aio
 import sublime
 import sublime_plugin
@@ -37,8 +37,10 @@ class mir_show_references_command(sublime_aio.ViewCommand):
             workspace_edits: WorkspaceEdit = {
                 'changes': {}
             }
-            for reference in extended_locations:
-                _, file_path= parse_uri(reference['uri'])
+            multibuffer = Multibuffer(w, 'mir-references-view')
+            file_paths = [parse_uri(reference['uri'])[1] for reference in extended_locations]
+            lines = multibuffer.line_reader.get_many([(file_path, reference['range']['start']['line'], reference['range']['end']['line']) for file_path, reference in zip(file_paths, extended_locations)])
+            for reference, file_path, new_text in zip(extended_locations, file_paths, lines):
                 content.append({
                     'type': 'Buffer',
                     'file_path': file_path,
@@ -56,10 +58,9 @@ class mir_show_references_command(sublime_aio.ViewCommand):
                             'character': -1
                         }
                     },
-                    'newText': get_lines(w, file_path, reference['range']['start']['line'], reference['range']['end']['line'])
+                    'newText': new_text
                 })
 
-            multibuffer = Multibuffer(w, 'mir-references-view')
             multibuffer.open(title, content)
             w.settings().set('mir.reference_workspace_edits', workspace_edits)
         except Exception as e:
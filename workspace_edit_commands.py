@@ -3,7 +3,7 @@ from __future__ import annotations
 from .libs.future_with_id import FutureWithId
 import sublime_aio
 
-from Mir import mir_logger, is_text_document_edit, parse_uri, is_text_edit, range_to_region, open_view, save_view, apply_text_document_edits
+from Mir import mir_logger, is_text_document_edit, parse_uri, is_text_edit, ranges_to_regions, open_view, save_view, apply_text_document_edits
 from Mir.types.lsp import WorkspaceEdit, TextEdit, AnnotatedTextEdit, SnippetTextEdit
 import sublime
 import sublime_plugin
@@ -64,5 +64,7 @@ class mir_apply_text_document_edits_command(sublime_plugin.TextCommand):
                 text_edits.append(e)
             else:
                 mir_logger.info('Mir TODO implement edit for', e)
-        for text_edit in reversed(text_edits):
-            self.view.replace(edit, range_to_region(self.view, text_edit['range']), text_edit['newText'])
+        # converted before the first replace, the edits are applied from the end so the regions stay valid
+        regions = ranges_to_regions(self.view, [text_edit['range'] for text_edit in text_edits])
+        for region, text_edit in reversed(list(zip(regions, text_edits))):
+            self.view.replace(edit, region, text_edit['newText'])